@@ -5,23 +5,68 @@
 import asyncio
 import json
 import hmac
+import random
 import hashlib
+import ssl
+import sys
 import time
-from typing import Dict, List, Callable, Optional
+from collections import deque
+from typing import Dict, List, Optional, Tuple
 import websockets
 import aiohttp
 import logging
 from urllib.parse import urlencode
+from yarl import URL
 
 logger = logging.getLogger(__name__)
 
+# WebSocket 消息解析：优先使用 msgspec 预构建的解码器（requirements 中固定），未安装时尝试可选的 orjson
+# （均为 C 实现，可直接解析 bytes），都没有则回退到标准库。解析结果统一为 dict，下游处理逻辑无需区分后端
+try:
+    import msgspec
+    _json_loads = msgspec.json.Decoder().decode
+except ImportError:
+    try:
+        import orjson
+        _json_loads = orjson.loads
+    except ImportError:
+        _json_loads = json.loads
+
+# 共享的 TLS 上下文：系统 CA 证书只加载一次，REST 连接池与每次 WebSocket 重连共用
+_SSL_CONTEXT = ssl.create_default_context()
+
+# 币安返回的零数量字符串（精度随交易对不同），命中时无需 float() 解析
+_ZERO_AMOUNTS = frozenset(['0'] + ['0.' + '0' * n for n in range(1, 9)])
+
 
 class BinanceClient:
     """币安交易所客户端"""
+
+    # REST 重试退避参数（秒）
+    RETRY_BASE_DELAY = 1
+    RETRY_MAX_DELAY = 30
+    RETRY_AFTER_CAP = 60
+    # 重试时复用旧签名的最长时间（秒），需明显小于 recvWindow 默认的 5 秒
+    SIGNATURE_REUSE_WINDOW = 2
+    # 服务器时间偏移校准间隔（秒）
+    TIME_SYNC_INTERVAL = 3600
+    # get_server_time 的缓存时长（秒）：距上次校准不足该时长时直接按偏移推算，不再请求
+    SERVER_TIME_TTL = 1
+    # 单调时钟推算的时间与墙钟推算的时间相差超过该值（毫秒）时视为时钟跳变（主机挂起、虚拟机暂停/迁移），
+    # 立即按墙钟重新确定偏移并尽快重新校准
+    CLOCK_JUMP_THRESHOLD_MS = 1000
+    # 批量获取K线时的最大并发请求数
+    KLINE_FETCH_CONCURRENCY = 10
+    # 不会改变持仓数量的 ACCOUNT_UPDATE 事件原因（a.m 字段），直接跳过持仓比对
+    NO_POSITION_CHANGE_REASONS = frozenset({
+        'FUNDING_FEE', 'DEPOSIT', 'WITHDRAW', 'WITHDRAW_REJECT', 'MARGIN_TRANSFER', 'ASSET_TRANSFER',
+    })
     
     def __init__(self, api_key: str, api_secret: str, testnet: bool = False):
         self.api_key = api_key
         self.api_secret = api_secret
+        # 预先完成密钥派生的 HMAC 模板，签名时 copy() 复用，避免每次重做 ipad/opad
+        self._hmac_template = hmac.new(api_secret.encode('utf-8'), digestmod=hashlib.sha256)
         self.testnet = testnet
         
         if testnet:
@@ -33,121 +78,247 @@ class BinanceClient:
         
         self.listen_key = None
         self.ws_connection = None
+        self.kline_ws_connection = None  # K线组合流连接（与用户数据流分开）
         self.session = None
         self.running = False
+
+        # 服务器时间相对单调时钟的偏移（毫秒），签名时间戳 = 单调时钟 + 偏移
+        # 基于单调时钟计算，NTP 调整本地墙钟时不会导致时间戳跳变；校准前先以本地墙钟为准
+        self._time_offset_ms = time.time_ns() // 1_000_000 - time.monotonic_ns() // 1_000_000
+        self._time_synced_at = None  # 上次成功校准的单调时钟时间（秒）
+        # 服务器时间相对本地墙钟的偏差（毫秒），用于检测单调时钟停走
+        self._wall_drift_ms = 0
+        # 检测到时钟跳变时置位，唤醒校准任务立即重新校准
+        self._time_resync_needed = asyncio.Event()
+
+        # 所有 REST 请求共用的请求头，避免每次请求重新构造
+        self._headers = {"X-MBX-APIKEY": api_key}
         
         # 持仓缓存，用于检测持仓变化（开仓/平仓）
-        # 双向持仓模式：{symbol_side: position_amt}
-        self.position_cache = {}  # {f"{symbol}_{side}": position_amt}
+        # 双向持仓模式：{(symbol, side): position_amt}
+        self.position_cache = {}  # {(symbol, side): position_amt}
         
         # 订单缓存，用于检测新订单（避免 WebSocket 重连时错过）
         self.order_cache = {}  # {order_id: order_info}
-        self.order_cache_lock = asyncio.Lock()  # 保护订单缓存的并发访问
+        # 订单对账进行中的标志：期间到达的订单事件先暂存，对账合并缓存后再按顺序补处理
+        # 缓存读写本身没有 await，在事件循环中天然原子，无需加锁
+        self._reconciling = False
+        self._pending_order_events = deque()
         
         # WebSocket 连接状态
         self.ws_connected = False
         self.last_ws_message_time = 0
 
         # 后台任务注册表（用于优雅停机）
+        # 任务结束时的移除回调预先绑定一次，避免每个任务都创建新的绑定方法
+        # 注意：不能改用 WeakSet，事件循环只弱引用任务，强引用必须由这里持有
         self._background_tasks = set()
+        self._discard_task = self._background_tasks.discard
 
         # 回调函数
-        self.on_position_update = None
+        self.on_position_update_batch = None  # 持仓更新回调：同一账户事件内的开仓/持仓变化一次传入
         self.on_position_closed = None  # 平仓回调
         self.on_order_update = None
         self.on_account_update = None
+        self.on_positions_reconciled = None  # 重连后持仓对账完成回调（断线期间可能漏掉持仓事件）
+        self.on_kline_closed = None  # K线收盘回调 (symbol, interval, kline)
+
+        # 当前订阅的K线流名称，如 btcusdt@kline_1h；重连后据此重新订阅
+        self._kline_streams = set()
+        self._kline_request_id = 0
+
+        # 用户数据流事件分发表（事件类型 -> 处理方法）
+        self._event_handlers = {
+            'listenKeyExpired': self._handle_listen_key_expired,
+            'ACCOUNT_UPDATE': self._handle_account_update,
+            'ORDER_TRADE_UPDATE': self._handle_order_update,
+        }
 
     def _track_task(self, coro):
         """创建并跟踪后台任务"""
         task = asyncio.create_task(coro)
         self._background_tasks.add(task)
-        task.add_done_callback(self._background_tasks.discard)
+        task.add_done_callback(self._discard_task)
         return task
 
-    def _generate_signature(self, params: Dict) -> str:
-        """生成签名"""
-        query_string = urlencode(params)
-        signature = hmac.new(
-            self.api_secret.encode('utf-8'),
-            query_string.encode('utf-8'),
-            hashlib.sha256
-        ).hexdigest()
-        return signature
+    def _generate_signature(self, query_string: str) -> str:
+        """生成签名（对已编码的查询串签名）"""
+        h = self._hmac_template.copy()
+        h.update(query_string.encode('utf-8'))
+        return h.hexdigest()
+
+    async def init_session(self):
+        """创建共享的 HTTP 会话（启动时调用一次，之后所有请求复用）"""
+        if self.session is not None:
+            return
+        # 创建带有超时和连接池配置的 session
+        # 空闲连接保活 75 秒（默认仅 15 秒），低频请求之间也能复用已建立的 TCP+TLS 连接
+        timeout = aiohttp.ClientTimeout(total=30, connect=10, sock_read=20)
+        connector = aiohttp.TCPConnector(
+            limit=100,
+            limit_per_host=30,
+            ttl_dns_cache=300,
+            keepalive_timeout=75,
+            enable_cleanup_closed=True,
+            ssl=_SSL_CONTEXT,
+        )
+        self.session = aiohttp.ClientSession(timeout=timeout, connector=connector)
+
+    def _timestamp_ms(self) -> int:
+        """按服务器时间偏移校准后的当前毫秒时间戳"""
+        timestamp = time.monotonic_ns() // 1_000_000 + self._time_offset_ms
+        wall_timestamp = time.time_ns() // 1_000_000 + self._wall_drift_ms
+        if abs(timestamp - wall_timestamp) > self.CLOCK_JUMP_THRESHOLD_MS:
+            # 单调时钟在主机挂起/虚拟机暂停期间停走（或墙钟被大幅调整），改以墙钟为准并尽快重新校准
+            logger.warning("检测到本地时钟跳变 %sms，按墙钟重新确定时间偏移", wall_timestamp - timestamp)
+            self._time_offset_ms += wall_timestamp - timestamp
+            self._time_synced_at = None
+            self._time_resync_needed.set()
+            return wall_timestamp
+        return timestamp
+
+    def _backoff_delay(self, attempt: int) -> float:
+        """指数退避 + 随机抖动，避免限频时多个请求同步重试"""
+        delay = min(self.RETRY_MAX_DELAY, self.RETRY_BASE_DELAY * 2 ** (attempt + 1))
+        return delay * random.uniform(0.5, 1.5)
 
     async def _request(self, method: str, endpoint: str, signed: bool = False, retry_count: int = 3, **kwargs):
         """发送 HTTP 请求，带重试机制"""
         url = f"{self.base_url}{endpoint}"
-        headers = {"X-MBX-APIKEY": self.api_key}
 
-        # 保存原始参数的副本，避免重试时签名污染
-        original_params = kwargs.get('params', {}).copy()
+        # 参数准备放在重试循环之外：查询串只编码一次，重试时直接复用
+        request_url = url
+        if not signed:
+            params = kwargs.pop('params', None)
+            if params:
+                request_url = URL(f"{url}?{urlencode(params)}", encoded=True)
+        else:
+            # 签名请求自行拼接查询串，不再交给 aiohttp 二次编码
+            original_params = kwargs.pop('params', {}).copy()
+            original_params.pop('signature', None)
+            original_params.pop('timestamp', None)
+            # 业务参数只编码一次，重新签名时仅追加新的 timestamp
+            base_query = urlencode(original_params)
+            if base_query:
+                base_query += '&'
+        signed_at = None
+        # -1021（时间戳超出 recvWindow）时重新校准并重签一次，不计入重试次数
+        resynced = False
 
-        for attempt in range(retry_count):
+        attempt = 0
+        while attempt < retry_count:
             try:
-                if signed:
-                    # 每次重试都基于原始参数重新构造，避免旧 signature 被签入
-                    params = original_params.copy()
-                    params.pop('signature', None)
-                    params.pop('timestamp', None)
-                    params['timestamp'] = int(time.time() * 1000)
-                    params['signature'] = self._generate_signature(params)
-                    kwargs['params'] = params
-
-                if self.session is None:
-                    # 创建带有超时和连接池配置的 session
-                    timeout = aiohttp.ClientTimeout(total=30, connect=10, sock_read=20)
-                    connector = aiohttp.TCPConnector(limit=100, limit_per_host=30, ttl_dns_cache=300)
-                    self.session = aiohttp.ClientSession(timeout=timeout, connector=connector)
-
-                async with self.session.request(method, url, headers=headers, **kwargs) as response:
+                # 首次请求或旧时间戳即将过期时才重新签名，快速重试直接复用上一次的签名
+                if signed and (signed_at is None or time.monotonic() - signed_at > self.SIGNATURE_REUSE_WINDOW):
+                    # 基于原始参数重新构造，避免旧 signature 被签入
+                    query_string = f"{base_query}timestamp={self._timestamp_ms()}"
+                    signature = self._generate_signature(query_string)
+                    # 查询串只编码一次：签名与实际发送共用同一份字符串
+                    request_url = URL(f"{url}?{query_string}&signature={signature}", encoded=True)
+                    signed_at = time.monotonic()
+
+                async with self.session.request(method, request_url, headers=self._headers, **kwargs) as response:
                     data = await response.json()
 
                     if response.status == 200:
                         return data
 
+                    if signed and not resynced and isinstance(data, dict) and data.get('code') == -1021:
+                        resynced = True
+                        logger.warning("签名时间戳超出 recvWindow: %s，重新校准服务器时间后重新签名", data)
+                        try:
+                            await self.sync_time()
+                        except Exception as e:
+                            logger.warning("重新校准服务器时间失败: %s", e)
+                        else:
+                            signed_at = None
+                            continue
+
                     # 可重试的 HTTP 状态码（429限频、5xx服务端错误）
+                    # 最后一次尝试不再等待，直接抛出
                     if response.status in (429, 500, 502, 503, 504) and attempt < retry_count - 1:
-                        retry_after = int(response.headers.get('Retry-After', 2 ** attempt))
-                        logger.warning(f"API 返回 {response.status}，{retry_after}秒后重试...")
-                        await asyncio.sleep(retry_after)
+                        # 优先遵循服务端 Retry-After（设上限），否则使用带抖动的指数退避
+                        retry_after = response.headers.get('Retry-After', '')
+                        if retry_after.isdigit():
+                            wait_time = min(int(retry_after), self.RETRY_AFTER_CAP)
+                        else:
+                            wait_time = self._backoff_delay(attempt)
+                        logger.warning("API 返回 %s，%.1f秒后重试...", response.status, wait_time)
+                        await asyncio.sleep(wait_time)
+                        attempt += 1
                         continue
 
                     # 不可重试的错误，直接抛出
-                    logger.error(f"API 请求失败 [{response.status}]: {data}")
+                    logger.error("API 请求失败 [%s]: %s", response.status, data)
                     raise Exception(f"API Error [{response.status}]: {data}")
 
             except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
-                logger.warning(f"API 请求失败 (尝试 {attempt + 1}/{retry_count}): {e}")
+                logger.warning("API 请求失败 (尝试 %s/%s): %s", attempt + 1, retry_count, e)
                 if attempt < retry_count - 1:
-                    # 指数退避：2秒、4秒、8秒
-                    wait_time = 2 ** (attempt + 1)
-                    logger.info(f"等待 {wait_time} 秒后重试...")
+                    # 指数退避（约2秒、4秒、8秒，带抖动，上限30秒）
+                    wait_time = self._backoff_delay(attempt)
+                    logger.info("等待 %.1f 秒后重试...", wait_time)
                     await asyncio.sleep(wait_time)
                 else:
-                    logger.error(f"API 请求最终失败，endpoint: {endpoint}")
+                    logger.error("API 请求最终失败，endpoint: %s", endpoint)
                     raise
+            attempt += 1
 
     async def get_server_time(self) -> int:
         """获取币安服务器时间（毫秒时间戳）
 
-        用于校准本地时钟，避免K线收盘判断偏差
+        用于校准本地时钟，避免K线收盘判断偏差；短时间内重复调用直接复用刚校准的偏移
         """
+        if self._time_synced_at is not None and time.monotonic() - self._time_synced_at < self.SERVER_TIME_TTL:
+            return self._timestamp_ms()
         try:
-            data = await self._request('GET', '/fapi/v1/time', retry_count=2)
-            return data['serverTime']
+            return await self.sync_time()
         except Exception as e:
-            logger.warning(f"获取服务器时间失败，回退到本地时间: {e}")
-            return int(time.time() * 1000)
+            logger.warning("获取服务器时间失败，回退到校准后的本地时间: %s", e)
+            return self._timestamp_ms()
+
+    async def sync_time(self) -> int:
+        """拉取服务器时间并更新本地时钟偏移，返回服务器时间（毫秒时间戳）"""
+        wall_before = time.time_ns() // 1_000_000
+        local_before = time.monotonic_ns() // 1_000_000
+        data = await self._request('GET', '/fapi/v1/time', retry_count=2)
+        local_after = time.monotonic_ns() // 1_000_000
+        wall_after = time.time_ns() // 1_000_000
+        server_time = data['serverTime']
+        # 以请求往返的中点近似服务器打时间戳的时刻
+        self._time_offset_ms = server_time - (local_before + local_after) // 2
+        self._wall_drift_ms = server_time - (wall_before + wall_after) // 2
+        self._time_synced_at = time.monotonic()
+        self._time_resync_needed.clear()
+        return server_time
+
+    async def _time_sync_loop(self):
+        """定期校准服务器时间偏移（启动时立即校准一次）"""
+        while self.running:
+            try:
+                await self.sync_time()
+                logger.debug("服务器时间与本地时钟偏差: %sms", self._wall_drift_ms)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.warning("校准服务器时间失败，沿用上次偏移: %s", e)
+            try:
+                # 定期校准；检测到时钟跳变时提前唤醒
+                await asyncio.wait_for(self._time_resync_needed.wait(), self.TIME_SYNC_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                break
 
     async def get_listen_key(self) -> str:
         """获取 User Data Stream 的 listen key"""
         try:
             data = await self._request('POST', '/fapi/v1/listenKey', retry_count=5)
             self.listen_key = data['listenKey']
-            logger.info(f"获取到 Listen Key: {self.listen_key[:8]}...")
+            logger.info("获取到 Listen Key: %s...", self.listen_key[:8])
             return self.listen_key
         except Exception as e:
-            logger.error(f"获取 Listen Key 失败: {e}")
+            logger.error("获取 Listen Key 失败: %s", e)
             raise
 
     async def keep_alive_listen_key(self):
@@ -162,7 +333,7 @@ class BinanceClient:
                         await self._request('PUT', '/fapi/v1/listenKey', retry_count=3)
                         logger.info("Listen Key 已更新")
                     except Exception as e:
-                        logger.error(f"更新 Listen Key 失败: {e}")
+                        logger.error("更新 Listen Key 失败: %s", e)
                         # 清空 listen_key，让 WebSocket 重连时重新获取
                         self.listen_key = None
                         # 主动关闭 WebSocket，避免僵尸连接
@@ -175,7 +346,7 @@ class BinanceClient:
             except asyncio.CancelledError:
                 break
             except Exception as e:
-                logger.error(f"Keep alive 任务错误: {e}")
+                logger.error("Keep alive 任务错误: %s", e)
 
     async def _ws_health_check(self):
         """WebSocket 健康检查：检测僵尸连接并强制重连"""
@@ -192,8 +363,8 @@ class BinanceClient:
                 elapsed = time.time() - self.last_ws_message_time
                 if elapsed > stale_threshold:
                     logger.warning(
-                        f"WebSocket 已 {elapsed:.0f}s 未收到消息，"
-                        f"疑似僵尸连接，强制重连..."
+                        "WebSocket 已 %.0fs 未收到消息，"
+                        "疑似僵尸连接，强制重连...", elapsed
                     )
                     self.listen_key = None
                     if self.ws_connection:
@@ -204,7 +375,7 @@ class BinanceClient:
             except asyncio.CancelledError:
                 break
             except Exception as e:
-                logger.error(f"WebSocket 健康检查错误: {e}")
+                logger.error("WebSocket 健康检查错误: %s", e)
 
     async def get_positions(self) -> List[Dict]:
         """获取当前所有持仓
@@ -215,29 +386,30 @@ class BinanceClient:
         data = await self._request('GET', '/fapi/v2/positionRisk', signed=True)
         
         # 过滤出有持仓的交易对（支持双向持仓）
-        positions = []
-        for pos in data:
-            position_amt = float(pos['positionAmt'])
-            # 双向持仓模式下，API会返回每个方向的记录，只保留实际有持仓的
-            if position_amt != 0:
-                # 获取持仓方向（双向持仓模式下API会直接返回positionSide字段）
-                position_side = pos.get('positionSide', 'BOTH')
-                
-                # 如果API没有返回positionSide（单向持仓模式），根据数量判断
-                if position_side == 'BOTH':
-                    position_side = 'LONG' if position_amt > 0 else 'SHORT'
-                
-                positions.append({
-                    'symbol': pos['symbol'],
-                    'side': position_side,  # LONG 或 SHORT
-                    'position_amt': abs(position_amt),
-                    'entry_price': float(pos['entryPrice']),
-                    'unrealized_pnl': float(pos['unRealizedProfit']),
-                    'leverage': int(pos['leverage']),
-                    'liquidation_price': float(pos['liquidationPrice'])
-                })
-        
-        return positions
+        # 双向持仓模式下API会返回每个方向的记录，只保留实际有持仓的
+        return [
+            {
+                'symbol': sys.intern(pos['symbol']),
+                'side': self._resolve_position_side(pos.get('positionSide', 'BOTH'), position_amt),  # LONG 或 SHORT
+                'position_amt': abs(position_amt),
+                'entry_price': float(pos['entryPrice']),
+                'unrealized_pnl': float(pos['unRealizedProfit']),
+                'leverage': int(pos['leverage']),
+                'liquidation_price': float(pos['liquidationPrice'])
+            }
+            for pos, position_amt in (
+                (pos, float(pos['positionAmt'])) for pos in data
+                if pos['positionAmt'] not in _ZERO_AMOUNTS  # 大部分交易对无持仓，先按字符串快速过滤
+            )
+            if position_amt != 0
+        ]
+
+    @staticmethod
+    def _resolve_position_side(position_side: str, position_amt: float) -> str:
+        """确定持仓方向：双向持仓模式下API直接返回positionSide；单向持仓模式（BOTH）根据数量判断"""
+        if position_side == 'BOTH':
+            return 'LONG' if position_amt > 0 else 'SHORT'
+        return position_side
 
     async def get_futures_balance(self) -> List[Dict]:
         """获取合约账户余额
@@ -268,9 +440,8 @@ class BinanceClient:
         
         data = await self._request('GET', '/fapi/v1/openOrders', signed=True, params=params)
         
-        orders = []
-        for order in data:
-            orders.append({
+        return [
+            {
                 'order_id': order['orderId'],
                 'symbol': order['symbol'],
                 'side': order['side'],
@@ -281,9 +452,9 @@ class BinanceClient:
                 'time': order['time'],
                 'stop_price': float(order.get('stopPrice', 0)),  # 触发价格
                 'reduce_only': order.get('reduceOnly', False)  # 只减仓模式
-            })
-        
-        return orders
+            }
+            for order in data
+        ]
 
     async def place_market_order(self, symbol: str, side: str, quantity: float, 
                                   position_side: Optional[str] = None) -> Dict:
@@ -306,7 +477,7 @@ class BinanceClient:
         if position_side:
             params['positionSide'] = position_side
         
-        logger.info(f"下市价单: {symbol} {side} {quantity} (positionSide={position_side})")
+        logger.info("下市价单: %s %s %s (positionSide=%s)", symbol, side, quantity, position_side)
         data = await self._request('POST', '/fapi/v1/order', signed=True, params=params)
         
         return {
@@ -328,28 +499,137 @@ class BinanceClient:
         
         data = await self._request('GET', '/fapi/v1/klines', params=params)
         
-        klines = []
-        for k in data:
-            klines.append({
-                'open_time': k[0],
-                'open': float(k[1]),
-                'high': float(k[2]),
-                'low': float(k[3]),
-                'close': float(k[4]),
-                'volume': float(k[5]),
-                'close_time': k[6]
-            })
-        
-        return klines
+        # 单次推导式完成解析：每行只按位置解包一次，不再逐条 append
+        return [
+            {
+                'open_time': open_time,
+                'open': float(open_price),
+                'high': float(high),
+                'low': float(low),
+                'close': float(close),
+                'volume': float(volume),
+                'close_time': close_time
+            }
+            for open_time, open_price, high, low, close, volume, close_time, *_ in data
+        ]
+
+    async def get_klines_multi(self, pairs, limit: int = 1) -> Dict[Tuple[str, str], List[Dict]]:
+        """并发获取多个 (symbol, interval) 的K线，返回 {(symbol, interval): klines}，失败的组合记录日志后省略"""
+        pairs = list(pairs)
+        semaphore = asyncio.Semaphore(self.KLINE_FETCH_CONCURRENCY)
+
+        async def fetch(symbol, interval):
+            async with semaphore:
+                return await self.get_kline_data(symbol, interval, limit=limit)
+
+        results = await asyncio.gather(
+            *(fetch(symbol, interval) for symbol, interval in pairs), return_exceptions=True
+        )
+        klines_by_pair = {}
+        for (symbol, interval), result in zip(pairs, results):
+            if isinstance(result, Exception):
+                logger.error("获取 %s [%s] K线失败: %s", symbol, interval, result)
+            else:
+                klines_by_pair[(symbol, interval)] = result
+        return klines_by_pair
+
+    def estimated_server_time(self) -> int:
+        """按已校准的偏移估算当前服务器时间（毫秒，不发请求）"""
+        return self._timestamp_ms()
+
+    async def update_kline_subscriptions(self, pairs):
+        """把K线订阅调整为给定的 (symbol, interval) 集合，只发送增量 SUBSCRIBE/UNSUBSCRIBE"""
+        wanted = {f"{symbol.lower()}@kline_{interval}" for symbol, interval in pairs}
+        added = wanted - self._kline_streams
+        removed = self._kline_streams - wanted
+        self._kline_streams = wanted
+        if removed:
+            await self._send_kline_command('UNSUBSCRIBE', removed)
+        if added:
+            await self._send_kline_command('SUBSCRIBE', added)
+
+    async def _send_kline_command(self, method: str, streams):
+        """向K线组合流发送订阅指令（未连接时跳过，连接建立后会按当前集合统一订阅）"""
+        ws = self.kline_ws_connection
+        if ws is None:
+            return
+        self._kline_request_id += 1
+        try:
+            await ws.send(json.dumps({'method': method, 'params': sorted(streams), 'id': self._kline_request_id}))
+        except websockets.ConnectionClosed:
+            pass  # 连接已断开，重连后重新订阅
+
+    async def start_kline_stream(self):
+        """启动K线组合流 WebSocket，只分发已收盘的K线（替代按周期轮询 REST K线接口）"""
+        self.running = True
+        reconnect_delay = 5  # 初始重连延迟
+        max_reconnect_delay = 60  # 最大重连延迟
+
+        while self.running:
+            try:
+                async with websockets.connect(
+                    f"{self.ws_base_url}/stream",
+                    ssl=_SSL_CONTEXT,
+                    ping_interval=20,
+                    ping_timeout=10,
+                    close_timeout=10,
+                    max_size=2 ** 20,
+                    compression=None
+                ) as ws:
+                    self.kline_ws_connection = ws
+                    logger.info("WebSocket K线流已连接")
+                    reconnect_delay = 5
+
+                    if self._kline_streams:
+                        await self._send_kline_command('SUBSCRIBE', self._kline_streams)
+
+                    async for message in ws:
+                        if not self.running:
+                            break
+                        # 绝大多数推送是未收盘K线的实时更新，不含收盘标记时直接跳过，不做 JSON 解析
+                        if '"x":true' not in message:
+                            continue
+                        payload = _json_loads(message)
+                        k = payload.get('data', payload).get('k')
+                        if not k or not k['x'] or not self.on_kline_closed:
+                            continue
+                        await self.on_kline_closed(k['s'], k['i'], {
+                            'open_time': k['t'],
+                            'open': float(k['o']),
+                            'high': float(k['h']),
+                            'low': float(k['l']),
+                            'close': float(k['c']),
+                            'volume': float(k['v']),
+                            'close_time': k['T']
+                        })
+
+            except asyncio.CancelledError:
+                break
+
+            except Exception as e:
+                if not self.running:
+                    break
+                if isinstance(e, websockets.ConnectionClosed):
+                    logger.warning("WebSocket K线流断开 (code: %s, reason: %s)，%s秒后重连...", e.code, e.reason, reconnect_delay)
+                else:
+                    logger.error("WebSocket K线流错误: %s，%s秒后重连...", e, reconnect_delay)
+                self.kline_ws_connection = None
+                await asyncio.sleep(reconnect_delay)
+                reconnect_delay = min(reconnect_delay * 1.5, max_reconnect_delay)
+
+        logger.info("WebSocket K线流已停止")
 
     async def start_user_data_stream(self):
         """启动用户数据流 WebSocket"""
         self.running = True
+        await self.init_session()
         
         # 启动 keep-alive 任务（纳入生命周期管理）
         self._track_task(self.keep_alive_listen_key())
         # 启动 WebSocket 健康检查任务
         self._track_task(self._ws_health_check())
+        # 启动服务器时间偏移校准任务
+        self._track_task(self._time_sync_loop())
 
         reconnect_delay = 5  # 初始重连延迟
         max_reconnect_delay = 60  # 最大重连延迟
@@ -365,9 +645,12 @@ class BinanceClient:
                 # 添加连接超时和心跳配置
                 async with websockets.connect(
                     ws_url,
+                    ssl=_SSL_CONTEXT,
                     ping_interval=20,  # 每20秒发送ping
                     ping_timeout=10,   # ping超时10秒
-                    close_timeout=10   # 关闭超时10秒
+                    close_timeout=10,  # 关闭超时10秒
+                    max_size=2 ** 20,  # 单帧上限1MB，用户数据流事件远小于此
+                    compression=None   # 不协商 permessage-deflate，省去每帧解压开销
                 ) as ws:
                     self.ws_connection = ws
                     self.ws_connected = True
@@ -382,15 +665,19 @@ class BinanceClient:
                     async for message in ws:
                         if not self.running:
                             break
-                        data = json.loads(message)
                         self.last_ws_message_time = time.time()
+                        # 没有任何回调订阅时跳过解析和分发；listenKeyExpired 仍需处理以触发重连
+                        # （用户数据流推送的是文本帧，message 为 str）
+                        if not self._has_subscribers() and 'listenKeyExpired' not in message:
+                            continue
+                        data = _json_loads(message)
                         await self._handle_user_data(data)
                         
             except websockets.ConnectionClosed as e:
                 if not self.running:
                     break
                 self.ws_connected = False
-                logger.warning(f"WebSocket 连接断开 (code: {e.code}, reason: {e.reason})，{reconnect_delay}秒后重连...")
+                logger.warning("WebSocket 连接断开 (code: %s, reason: %s)，%s秒后重连...", e.code, e.reason, reconnect_delay)
                 await asyncio.sleep(reconnect_delay)
                 # 指数退避，但不超过最大延迟
                 reconnect_delay = min(reconnect_delay * 1.5, max_reconnect_delay)
@@ -402,8 +689,8 @@ class BinanceClient:
                 if not self.running:
                     break
                 self.ws_connected = False
-                logger.error(f"WebSocket 错误: {e}", exc_info=True)
-                logger.info(f"{reconnect_delay}秒后重连...")
+                logger.error("WebSocket 错误: %s", e, exc_info=True)
+                logger.info("%s秒后重连...", reconnect_delay)
                 await asyncio.sleep(reconnect_delay)
                 # 指数退避，但不超过最大延迟
                 reconnect_delay = min(reconnect_delay * 1.5, max_reconnect_delay)
@@ -430,7 +717,7 @@ class BinanceClient:
 
             logger.info("WebSocket 重连后全量对账完成")
         except Exception as e:
-            logger.error(f"重连后全量对账失败: {e}", exc_info=True)
+            logger.error("重连后全量对账失败: %s", e, exc_info=True)
 
     async def _reconcile_positions(self):
         """持仓全量对账：REST 快照与缓存比对"""
@@ -438,16 +725,15 @@ class BinanceClient:
             positions = await self.get_positions()
             current_snapshot = {}
             for pos in positions:
-                key = f"{pos['symbol']}_{pos['side']}"
+                key = (pos['symbol'], pos['side'])
                 amt = pos['position_amt'] if pos['side'] == 'LONG' else -pos['position_amt']
                 current_snapshot[key] = amt
 
             # 检测缓存中有但实际已平仓的持仓
             for key, old_amt in list(self.position_cache.items()):
                 if key not in current_snapshot and old_amt != 0:
-                    symbol = key.rsplit('_', 1)[0]
-                    side = key.rsplit('_', 1)[1]
-                    logger.warning(f"对账发现已平仓: {key} (缓存={old_amt})")
+                    symbol, side = key
+                    logger.warning("对账发现已平仓: %s %s (缓存=%s)", symbol, side, old_amt)
                     del self.position_cache[key]
                     if self.on_position_closed:
                         await self.on_position_closed({
@@ -459,14 +745,17 @@ class BinanceClient:
             # 检测实际有但缓存中没有的新持仓
             for key, new_amt in current_snapshot.items():
                 if key not in self.position_cache:
-                    logger.warning(f"对账发现新持仓: {key} (数量={new_amt})")
+                    logger.warning("对账发现新持仓: %s %s (数量=%s)", key[0], key[1], new_amt)
 
-            # 更新缓存为最新快照
-            self.position_cache = current_snapshot
-            logger.info(f"持仓对账完成，当前持仓数: {len(current_snapshot)}")
+            # 原地更新缓存为最新快照（保持同一个 dict 对象，持有其引用的处理流程不会写入旧对象）
+            self.position_cache.clear()
+            self.position_cache.update(current_snapshot)
+            logger.info("持仓对账完成，当前持仓数: %s", len(current_snapshot))
+            if self.on_positions_reconciled:
+                await self.on_positions_reconciled()
 
         except Exception as e:
-            logger.error(f"持仓对账失败: {e}", exc_info=True)
+            logger.error("持仓对账失败: %s", e, exc_info=True)
 
     async def _check_missed_orders(self):
         """检查 WebSocket 重连期间是否错过了新订单
@@ -481,242 +770,278 @@ class BinanceClient:
             if not self.ws_connected:
                 return
             
-            logger.info("检查 WebSocket 重连期间是否有新订单...")
+            # 已有对账任务在进行时直接跳过，避免重复拉取
+            if self._reconciling:
+                logger.info("订单对账已在进行中，跳过本次检查")
+                return
             
-            # 获取当前所有委托订单
-            current_orders = await self.get_open_orders()
+            logger.info("检查 WebSocket 重连期间是否有新订单...")
             
-            # 使用锁保护订单缓存的访问，避免与 WebSocket 消息处理并发冲突
-            async with self.order_cache_lock:
-                # 检查是否有新订单（在缓存中不存在的订单）
-                new_orders = []
-                for order in current_orders:
-                    order_id = order['order_id']
-                    if order_id not in self.order_cache:
-                        new_orders.append(order)
-                        # 更新缓存
-                        self.order_cache[order_id] = order
+            # 拉取快照期间到达的订单事件暂存起来，避免快照把期间新建的订单误清理；
+            # 新订单通知发出后再补处理，用户不会先看到某订单的成交/撤销、后看到它的新订单通知
+            self._reconciling = True
+            try:
+                # 获取当前所有委托订单
+                current_orders = await self.get_open_orders()
                 
-                # 清理缓存中已经不存在的订单
                 current_order_ids = {order['order_id'] for order in current_orders}
-                cached_order_ids = set(self.order_cache.keys())
-                closed_order_ids = cached_order_ids - current_order_ids
-                
+
+                # 清理缓存中已经不存在的订单（keys 视图直接做差集，不再额外复制成 set）
+                closed_order_ids = self.order_cache.keys() - current_order_ids
                 for order_id in closed_order_ids:
                     del self.order_cache[order_id]
-                
+
                 if closed_order_ids:
-                    logger.info(f"清理了 {len(closed_order_ids)} 个已完成的订单缓存")
-            
-            # 在锁外发送通知，避免阻塞其他操作
-            if new_orders:
-                logger.info(f"发现 {len(new_orders)} 个新订单（WebSocket 重连期间创建）")
+                    logger.info("清理了 %s 个已完成的订单缓存", len(closed_order_ids))
+
+                # 检查是否有新订单（在缓存中不存在的订单），并更新缓存
+                new_orders = [order for order in current_orders if order['order_id'] not in self.order_cache]
                 for order in new_orders:
-                    if self.on_order_update:
-                        # 构建订单信息，格式与 WebSocket 推送一致
-                        order_info = {
-                            'symbol': order['symbol'],
-                            'order_id': order['order_id'],
-                            'side': order['side'],
-                            'type': order['type'],
-                            'status': order['status'],
-                            'price': order['price'],
-                            'quantity': order['quantity'],
-                            'executed_qty': 0.0,  # 从 REST API 无法获取已成交数量，默认为0
-                            'stop_price': order.get('stop_price', 0.0),
-                            'reduce_only': order.get('reduce_only', False),
-                            'time': order['time']
-                        }
-                        await self.on_order_update(order_info)
-            else:
-                logger.info("未发现新订单")
+                    self.order_cache[order['order_id']] = order
+
+                if not new_orders:
+                    logger.info("未发现新订单")
+                    return
+
+                logger.info("发现 %s 个新订单（WebSocket 重连期间创建）", len(new_orders))
+                if self.on_order_update is None:
+                    return
+
+                for order in new_orders:
+                    # 构建订单信息，格式与 WebSocket 推送一致
+                    order_info = {
+                        'symbol': order['symbol'],
+                        'order_id': order['order_id'],
+                        'side': order['side'],
+                        'type': order['type'],
+                        'status': order['status'],
+                        'price': order['price'],
+                        'quantity': order['quantity'],
+                        'executed_qty': 0.0,  # 从 REST API 无法获取已成交数量，默认为0
+                        'stop_price': order.get('stop_price', 0.0),
+                        'reduce_only': order.get('reduce_only', False),
+                        'time': order['time']
+                    }
+                    await self.on_order_update(order_info)
+            finally:
+                await self._drain_pending_order_events()
                 
         except Exception as e:
-            logger.error(f"检查错过的订单时出错: {e}", exc_info=True)
+            logger.error("检查错过的订单时出错: %s", e, exc_info=True)
+
+    async def _drain_pending_order_events(self):
+        """按到达顺序补处理对账期间暂存的订单事件，处理完后解除暂存状态"""
+        try:
+            while self._pending_order_events:
+                data = self._pending_order_events.popleft()
+                try:
+                    await self._apply_order_update(data)
+                except Exception as e:
+                    logger.error("补处理订单事件失败: %s", e, exc_info=True)
+        finally:
+            self._reconciling = False
+
+    def _has_subscribers(self) -> bool:
+        """是否注册了任意用户数据流回调"""
+        return (
+            self.on_position_update_batch is not None
+            or self.on_position_closed is not None
+            or self.on_order_update is not None
+            or self.on_account_update is not None
+        )
 
     async def _handle_user_data(self, data: Dict):
-        """处理用户数据流消息"""
-        event_type = data.get('e')
-
-        if event_type == 'listenKeyExpired':
-            logger.warning("收到 listenKeyExpired 事件，listenKey 已过期，强制重连...")
-            self.listen_key = None
-            # 主动关闭 WebSocket，触发重连循环
-            if self.ws_connection:
-                await self.ws_connection.close()
-            return
+        """处理用户数据流消息：按事件类型分发"""
+        handler = self._event_handlers.get(data.get('e'))
+        if handler:
+            await handler(data)
 
-        if event_type == 'ACCOUNT_UPDATE':
-            # 账户更新事件
-            logger.info(f"账户更新事件: {data}")
+    async def _handle_listen_key_expired(self, data: Dict):
+        """listenKey 过期事件"""
+        logger.warning("收到 listenKeyExpired 事件，listenKey 已过期，强制重连...")
+        self.listen_key = None
+        # 主动关闭 WebSocket，触发重连循环
+        if self.ws_connection:
+            await self.ws_connection.close()
+
+    async def _handle_account_update(self, data: Dict):
+        """账户更新事件"""
+        logger.info("账户更新事件: %s", data)
+        
+        # 检查事件类型，如果是资金费率支付、划转等不涉及持仓变化的事件，跳过持仓更新
+        event_reason = data.get('a', {}).get('m', '')
+        if event_reason in self.NO_POSITION_CHANGE_REASONS:
+            logger.debug("%s 事件不涉及持仓变化，跳过持仓更新", event_reason)
+            if self.on_account_update:
+                await self.on_account_update(data)
+            return
+        
+        # 处理持仓更新
+        if 'a' in data and 'P' in data['a']:
+            positions = data['a']['P']
             
-            # 检查事件类型，如果是资金费率支付等不涉及持仓变化的事件，跳过持仓更新
-            event_reason = data.get('a', {}).get('m', '')
-            if event_reason == 'FUNDING_FEE':
-                logger.debug(f"资金费率支付事件，跳过持仓更新")
+            # 如果持仓数组为空，说明没有持仓变化，跳过更新
+            if not positions:
+                logger.debug("持仓数组为空，跳过持仓更新")
                 if self.on_account_update:
                     await self.on_account_update(data)
                 return
             
-            # 处理持仓更新
-            if 'a' in data and 'P' in data['a']:
-                positions = data['a']['P']
-                
-                # 如果持仓数组为空，说明没有持仓变化，跳过更新
-                if not positions:
-                    logger.debug(f"持仓数组为空，跳过持仓更新")
-                    if self.on_account_update:
-                        await self.on_account_update(data)
-                    return
+            # 创建当前持仓快照（只包含本次更新中明确提到的交易对）
+            # 支持双向持仓：使用 (symbol, side) 作为key，每条记录为 (key, 数量, 原始数据) 元组
+            current_positions = []
+            for pos in positions:
+                # 驻留交易对字符串：缓存 key 复用同一对象，后续查找直接按身份比较
+                symbol = sys.intern(pos['s'])
+                raw_amt = pos['pa']
+                position_amt = 0.0 if raw_amt in _ZERO_AMOUNTS else float(raw_amt)
+                # 获取持仓方向（双向持仓模式下API会返回ps字段）
+                position_side = pos.get('ps', 'BOTH')
                 
-                # 创建当前持仓快照（只包含本次更新中明确提到的交易对）
-                # 支持双向持仓：使用 symbol_side 作为key
-                current_positions = {}
-                for pos in positions:
-                    symbol = pos['s']
-                    position_amt = float(pos['pa'])
-                    # 获取持仓方向（双向持仓模式下API会返回ps字段）
-                    position_side = pos.get('ps', 'BOTH')
-                    
-                    # 如果是单向持仓模式（BOTH），根据数量判断方向
-                    if position_side == 'BOTH':
-                        if position_amt > 0:
+                # 如果是单向持仓模式（BOTH），根据数量判断方向
+                if position_side == 'BOTH':
+                    if position_amt > 0:
+                        position_side = 'LONG'
+                    elif position_amt < 0:
+                        position_side = 'SHORT'
+                    else:
+                        # pa=0 表示平仓，从缓存中推断原方向
+                        if (symbol, 'LONG') in self.position_cache:
                             position_side = 'LONG'
-                        elif position_amt < 0:
+                        elif (symbol, 'SHORT') in self.position_cache:
                             position_side = 'SHORT'
                         else:
-                            # pa=0 表示平仓，从缓存中推断原方向
-                            cached_long = f"{symbol}_LONG"
-                            cached_short = f"{symbol}_SHORT"
-                            if cached_long in self.position_cache:
-                                position_side = 'LONG'
-                            elif cached_short in self.position_cache:
-                                position_side = 'SHORT'
-                            else:
-                                # 缓存中也没有，跳过此条
-                                logger.debug(f"单向模式 {symbol} pa=0 且缓存无记录，跳过")
-                                continue
-                    
-                    position_key = f"{symbol}_{position_side}"
-                    current_positions[position_key] = {
-                        'amt': position_amt,
-                        'side': position_side,
-                        'data': pos
-                    }
+                            # 缓存中也没有，跳过此条
+                            logger.debug("单向模式 %s pa=0 且缓存无记录，跳过", symbol)
+                            continue
                 
-                # 只检查本次更新中明确提到的交易对+方向（避免误判）
-                for position_key, pos_info in current_positions.items():
-                    old_amt = self.position_cache.get(position_key, 0.0)
-                    new_amt = pos_info['amt']
-                    position_side = pos_info['side']
-                    symbol = position_key.rsplit('_', 1)[0]
-                    
-                    # 检测平仓：从非0变为0
-                    if old_amt != 0 and new_amt == 0:
-                        logger.info(f"检测到平仓: {symbol} {position_side} (从 {old_amt} 变为 0)")
-                        if self.on_position_closed:
-                            await self.on_position_closed({
-                                'symbol': symbol,
-                                'previous_side': position_side,
-                                'previous_amount': abs(old_amt)
-                            })
-                    
-                    # 检测开仓或持仓变化：从0变为非0，或数量变化
-                    elif new_amt != 0:
-                        # 检查是否是新的持仓或持仓数量有变化
-                        if old_amt == 0 or abs(old_amt) != abs(new_amt):
-                            pos_data = pos_info['data']
-                            position_info = {
-                                'symbol': symbol,
-                                'side': position_side,
-                                'position_amt': abs(new_amt),
-                                'entry_price': float(pos_data.get('ep', 0)),
-                                'unrealized_pnl': float(pos_data.get('up', 0)),
-                                'leverage': int(pos_data.get('lv', 1)),  # 添加杠杆信息
-                                'liquidation_price': float(pos_data.get('lp', 0))  # 添加强平价信息
-                            }
-                            
-                            if self.on_position_update:
-                                await self.on_position_update(position_info)
+                current_positions.append(((symbol, position_side), position_amt, pos))
+            
+            # 只检查本次更新中明确提到的交易对+方向（避免误判），变化检测与缓存更新合并为一次遍历
+            cache = self.position_cache
+            # 同一事件内的持仓更新合并为一次回调；遇到平仓时先交付已收集的更新，保持事件内的先后顺序
+            batch_callback = self.on_position_update_batch
+            position_updates = []
+            for position_key, new_amt, pos_data in current_positions:
+                old_amt = cache.get(position_key, 0.0)
+                symbol, position_side = position_key
                 
-                # 更新持仓缓存（只更新本次更新中提到的交易对+方向）
-                for position_key, pos_info in current_positions.items():
-                    position_amt = pos_info['amt']
-                    if position_amt == 0:
-                        # 如果持仓变为0，从缓存中删除
-                        self.position_cache.pop(position_key, None)
-                    else:
-                        # 否则更新缓存
-                        self.position_cache[position_key] = position_amt
+                # 先更新缓存（持仓变为0则删除），再触发回调
+                if new_amt == 0:
+                    cache.pop(position_key, None)
+                else:
+                    cache[position_key] = new_amt
+                
+                # 检测平仓：从非0变为0
+                if old_amt != 0 and new_amt == 0:
+                    logger.info("检测到平仓: %s %s (从 %s 变为 0)", symbol, position_side, old_amt)
+                    if position_updates:
+                        await batch_callback(position_updates)
+                        position_updates = []
+                    if self.on_position_closed:
+                        await self.on_position_closed({
+                            'symbol': symbol,
+                            'previous_side': position_side,
+                            'previous_amount': abs(old_amt)
+                        })
+                
+                # 检测开仓或持仓变化：从0变为非0，或数量变化（未注册回调时不必构造通知数据）
+                elif new_amt != 0 and (old_amt == 0 or abs(old_amt) != abs(new_amt)) and batch_callback:
+                    position_updates.append({
+                        'symbol': symbol,
+                        'side': position_side,
+                        'position_amt': abs(new_amt),
+                        'entry_price': float(pos_data.get('ep', 0)),
+                        'unrealized_pnl': float(pos_data.get('up', 0)),
+                        'leverage': int(pos_data.get('lv', 1)),  # 添加杠杆信息
+                        'liquidation_price': float(pos_data.get('lp', 0))  # 添加强平价信息
+                    })
             
-            if self.on_account_update:
-                await self.on_account_update(data)
+            if position_updates:
+                await batch_callback(position_updates)
         
-        elif event_type == 'ORDER_TRADE_UPDATE':
-            # 订单更新事件
-            order = data['o']
-            order_info = {
-                'symbol': order['s'],
-                'order_id': order['i'],
-                'side': order['S'],
-                'type': order['o'],
-                'status': order['X'],
-                'price': float(order['p']),
-                'quantity': float(order['q']),
-                'executed_qty': float(order['z']),
-                'stop_price': float(order.get('sp', 0)),  # 添加止损触发价
-                'reduce_only': order.get('R', False),  # 添加只减仓标识
-                'time': data['E']
-            }
-            
-            logger.info(f"订单更新: {order_info['symbol']} {order_info['side']} {order_info['status']}")
-            
-            # 使用锁保护订单缓存的访问，避免与 _check_missed_orders() 并发冲突
-            order_id = order_info['order_id']
-            status = order_info['status']
-            should_notify = True
-            
-            async with self.order_cache_lock:
-                if status == 'NEW':
-                    # 新订单，检查是否已在缓存中（可能已被 _check_missed_orders() 处理）
-                    if order_id in self.order_cache:
-                        # 订单已在缓存中，说明已被 _check_missed_orders() 处理过
-                        # 不需要重复通知
-                        should_notify = False
-                        logger.debug(f"订单 {order_id} 已在缓存中，跳过重复通知")
-                    else:
-                        # 新订单，添加到缓存
-                        self.order_cache[order_id] = order_info
-                elif status in ['FILLED', 'CANCELED', 'EXPIRED', 'REJECTED']:
-                    # 订单已完成，从缓存中删除
-                    self.order_cache.pop(order_id, None)
-            
-            # 只在需要时发送通知
-            if should_notify and self.on_order_update:
-                await self.on_order_update(order_info)
+        if self.on_account_update:
+            await self.on_account_update(data)
+
+    async def _handle_order_update(self, data: Dict):
+        """订单更新事件"""
+        # 订单对账进行中：先暂存，等快照合并进缓存后再处理
+        if self._reconciling:
+            self._pending_order_events.append(data)
+            return
+        await self._apply_order_update(data)
+
+    async def _apply_order_update(self, data: Dict):
+        """处理订单更新：维护订单缓存并发送通知"""
+        order = data['o']
+        order_info = {
+            'symbol': order['s'],
+            'order_id': order['i'],
+            'side': order['S'],
+            'type': order['o'],
+            'status': order['X'],
+            'price': float(order['p']),
+            'quantity': float(order['q']),
+            'executed_qty': float(order['z']),
+            'stop_price': float(order.get('sp', 0)),  # 添加止损触发价
+            'reduce_only': order.get('R', False),  # 添加只减仓标识
+            'time': data['E']
+        }
+        
+        logger.info("订单更新: %s %s %s", order_info['symbol'], order_info['side'], order_info['status'])
+        
+        order_id = order_info['order_id']
+        status = order_info['status']
+        should_notify = True
+        
+        if status == 'NEW':
+            # 新订单，检查是否已在缓存中（可能已被 _check_missed_orders() 处理）
+            if order_id in self.order_cache:
+                # 订单已在缓存中，说明已被 _check_missed_orders() 处理过
+                # 不需要重复通知
+                should_notify = False
+                logger.debug("订单 %s 已在缓存中，跳过重复通知", order_id)
+            else:
+                # 新订单，添加到缓存
+                self.order_cache[order_id] = order_info
+        elif status in ['FILLED', 'CANCELED', 'EXPIRED', 'REJECTED']:
+            # 订单已完成，从缓存中删除
+            self.order_cache.pop(order_id, None)
+        
+        # 只在需要时发送通知
+        if should_notify and self.on_order_update:
+            await self.on_order_update(order_info)
 
     async def close(self):
         """关闭连接"""
         self.running = False
 
-        # 取消所有被追踪的后台任务
+        # 取消所有被追踪的后台任务（统一一条取消路径）
+        # 任务在收尾阶段可能再派生新任务，循环到注册表为空为止；完成回调会自动移出注册表
         if self._background_tasks:
-            logger.info(f"正在取消 {len(self._background_tasks)} 个后台任务...")
-            for task in list(self._background_tasks):
+            logger.info("正在取消 %s 个后台任务...", len(self._background_tasks))
+        while self._background_tasks:
+            tasks = list(self._background_tasks)
+            for task in tasks:
                 task.cancel()
-            await asyncio.gather(*self._background_tasks, return_exceptions=True)
-            self._background_tasks.clear()
+            await asyncio.gather(*tasks, return_exceptions=True)
 
         if self.ws_connection:
             try:
                 await self.ws_connection.close()
             except Exception as e:
-                logger.warning(f"关闭 WebSocket 连接时出错: {e}")
+                logger.warning("关闭 WebSocket 连接时出错: %s", e)
+
+        if self.kline_ws_connection:
+            try:
+                await self.kline_ws_connection.close()
+            except Exception as e:
+                logger.warning("关闭 K线 WebSocket 连接时出错: %s", e)
 
         if self.session:
             try:
                 await self.session.close()
             except Exception as e:
-                logger.warning(f"关闭 HTTP 会话时出错: {e}")
+                logger.warning("关闭 HTTP 会话时出错: %s", e)
 
         logger.info("币安客户端已关闭")
@@ -2,16 +2,63 @@
 数据库模型和管理模块
 用于存储 Telegram Bot 设置的止损信息
 """
+import asyncio
+import functools
+import queue
 import sqlite3
-from datetime import datetime
-from typing import List, Optional, Dict
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Optional, Dict, Tuple
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def _offload(func):
+    """把同步数据库操作包装为协程，在线程池中执行，避免阻塞事件循环"""
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        return await asyncio.to_thread(func, self, *args, **kwargs)
+    return wrapper
+
+
+# 查询列顺序与 StopLossOrder 构造参数顺序一致，行元组可直接按位置展开
+_ORDER_COLUMNS = 'id, symbol, side, stop_price, timeframe, quantity, created_at, updated_at'
+
+# 查询语句文本固定为模块常量：每次执行的文本完全相同，直接命中连接的预编译语句缓存
+_SELECT_BY_ID_SQL = f'SELECT {_ORDER_COLUMNS} FROM stop_loss_orders WHERE id = ?'
+_SELECT_BY_SYMBOL_SQL = f'SELECT {_ORDER_COLUMNS} FROM stop_loss_orders WHERE symbol = ?'
+_SELECT_ALL_SQL = f'SELECT {_ORDER_COLUMNS} FROM stop_loss_orders ORDER BY created_at DESC'
+
+# SQLite 3.35+ 支持 UPDATE ... RETURNING，更新与读取更新后的记录合为一条语句
+_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+# RETURNING 返回的是写入前的原始值（整数值的 REAL 列会以 int 返回），显式转换，与 SELECT 结果一致
+_RETURNING_COLUMNS = (
+    'id, symbol, side, CAST(stop_price AS REAL), timeframe, CAST(quantity AS REAL), created_at, updated_at'
+)
+
+# update_stop_loss 可更新的列（按位对应掩码 1/2/4）；7 种列组合的 UPDATE 语句预先生成，
+# 语句文本固定，可命中 sqlite3 的预编译语句缓存，不必每次重新解析
+_UPDATE_COLUMNS = ('stop_price', 'timeframe', 'quantity')
+_UPDATE_SQL = {
+    mask: "UPDATE stop_loss_orders SET "
+          + ", ".join(f"{col} = ?" for bit, col in enumerate(_UPDATE_COLUMNS) if mask >> bit & 1)
+          + ", updated_at = CURRENT_TIMESTAMP WHERE id = ?"
+          + (f" RETURNING {_RETURNING_COLUMNS}" if _HAS_RETURNING else "")
+    for mask in range(1, 1 << len(_UPDATE_COLUMNS))
+}
+
+
+def _order_row_factory(cursor, row):
+    """把查询结果行直接构造为 StopLossOrder（按位置，不经 sqlite3.Row 按列名取值）"""
+    return StopLossOrder(*row)
+
+
 class StopLossOrder:
     """止损订单数据模型"""
+    __slots__ = ('id', 'symbol', 'side', 'stop_price', 'timeframe', 'quantity', 'created_at', 'updated_at')
+
     def __init__(self, id=None, symbol=None, side=None, stop_price=None, 
                  timeframe=None, quantity=None, created_at=None, updated_at=None):
         self.id = id
@@ -38,188 +85,226 @@ class StopLossOrder:
 
 class Database:
     """数据库管理类"""
+
+    # 只读连接池大小（WAL 模式下读不阻塞写，多个读连接可在线程池中并行查询）
+    READER_POOL_SIZE = 2
+
     def __init__(self, db_path: str):
         self.db_path = db_path
+        # 查询/写入方法均为协程（在线程池中执行），调用方需 await
+        # 长连接：写连接只有一个，所有写操作通过 _lock 串行化；
+        # 查询走独立的只读连接池，不会排在写事务后面
+        self._lock = threading.Lock()
+        self._conn = self.get_connection()
         self.init_database()
+        self._readers = queue.Queue()
+        # 关闭标记：close() 之后归还的只读连接直接关闭，不再放回连接池（与归还操作由 _readers_lock 互斥）
+        self._closed = False
+        self._readers_lock = threading.Lock()
+        for _ in range(self.READER_POOL_SIZE):
+            self._readers.put(self.get_connection(readonly=True))
 
-    def get_connection(self):
-        """获取数据库连接（启用 WAL 模式提升并发性能）"""
-        conn = sqlite3.connect(self.db_path, timeout=10)
-        conn.row_factory = sqlite3.Row
-        conn.execute("PRAGMA journal_mode=WAL")
+    def get_connection(self, readonly: bool = False):
+        """创建数据库连接（启用 WAL 模式并设置连接级 PRAGMA）"""
+        # timeout=10 同时设置了 busy 等待时间，锁冲突时等待而不是直接报错
+        if readonly:
+            # 只读连接：由写连接负责切换 WAL 模式，这里不再设置
+            uri = f"{Path(self.db_path).resolve().as_uri()}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, timeout=10, check_same_thread=False)
+        else:
+            # isolation_level=None：由代码显式管理事务，写操作统一以 BEGIN IMMEDIATE 开始，
+            # 一开始就拿到写锁，避免 deferred 事务中途升级写锁时遇到 SQLITE_BUSY
+            conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")  # WAL 模式下安全，提交时不再每次 fsync
+        conn.execute("PRAGMA cache_size=-20000")  # 页缓存约 20MB
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=268435456")  # 256MB 内存映射读取
         return conn
 
+    @contextmanager
+    def _reader(self):
+        """借出一个只读连接，用完归还连接池（数据库已关闭时改为直接关闭该连接）"""
+        if self._closed:
+            raise sqlite3.ProgrammingError("数据库已关闭")
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            with self._readers_lock:
+                if self._closed:
+                    conn.close()
+                else:
+                    self._readers.put(conn)
+
+    @contextmanager
+    def _transaction(self):
+        """写事务：持写锁并以 BEGIN IMMEDIATE 开始，正常退出时提交、异常时回滚（由 with conn 完成）"""
+        with self._lock, self._conn as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            yield conn
+
+    def close(self):
+        """关闭数据库连接（借出中的只读连接在归还时关闭）"""
+        with self._readers_lock:
+            self._closed = True
+            while True:
+                try:
+                    self._readers.get_nowait().close()
+                except queue.Empty:
+                    break
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
     def init_database(self):
         """初始化数据库表"""
-        conn = self.get_connection()
         try:
-            cursor = conn.cursor()
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS stop_loss_orders (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    symbol TEXT NOT NULL,
-                    side TEXT NOT NULL,
-                    stop_price REAL NOT NULL,
-                    timeframe TEXT NOT NULL,
-                    quantity REAL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_symbol ON stop_loss_orders(symbol)
-            ''')
-            conn.commit()
-            logger.info("数据库初始化完成")
+            with self._transaction() as conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS stop_loss_orders (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        symbol TEXT NOT NULL,
+                        side TEXT NOT NULL,
+                        stop_price REAL NOT NULL,
+                        timeframe TEXT NOT NULL,
+                        quantity REAL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                # 复合索引的前缀同样覆盖按 symbol 的查询，旧的单列索引随之删除
+                conn.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_symbol_timeframe ON stop_loss_orders(symbol, timeframe)
+                ''')
+                conn.execute('DROP INDEX IF EXISTS idx_symbol')
         except Exception as e:
-            conn.rollback()
-            logger.error(f"数据库初始化失败: {e}")
+            logger.error("数据库初始化失败: %s", e)
             raise
-        finally:
-            conn.close()
+        logger.info("数据库初始化完成")
 
+    @_offload
     def add_stop_loss(self, symbol: str, side: str, stop_price: float,
                      timeframe: str, quantity: Optional[float] = None) -> int:
         """添加止损订单"""
-        conn = self.get_connection()
         try:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO stop_loss_orders (symbol, side, stop_price, timeframe, quantity)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (symbol, side, stop_price, timeframe, quantity))
-            order_id = cursor.lastrowid
-            conn.commit()
-            logger.info(f"添加止损订单: {symbol} {side} @ {stop_price} [{timeframe}]")
-            return order_id
+            with self._transaction() as conn:
+                cursor = conn.execute('''
+                    INSERT INTO stop_loss_orders (symbol, side, stop_price, timeframe, quantity)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (symbol, side, stop_price, timeframe, quantity))
         except Exception as e:
-            conn.rollback()
-            logger.error(f"添加止损订单失败: {e}")
+            logger.error("添加止损订单失败: %s", e)
             raise
-        finally:
-            conn.close()
+        logger.info("添加止损订单: %s %s @ %s [%s]", symbol, side, stop_price, timeframe)
+        return cursor.lastrowid
 
+    @_offload
     def get_stop_loss_by_id(self, order_id: int) -> Optional[StopLossOrder]:
         """根据ID获取止损订单"""
-        conn = self.get_connection()
-        try:
+        with self._reader() as conn:
             cursor = conn.cursor()
-            cursor.execute('SELECT * FROM stop_loss_orders WHERE id = ?', (order_id,))
-            row = cursor.fetchone()
-            if row:
-                return StopLossOrder(
-                    id=row['id'], symbol=row['symbol'], side=row['side'],
-                    stop_price=row['stop_price'], timeframe=row['timeframe'],
-                    quantity=row['quantity'], created_at=row['created_at'],
-                    updated_at=row['updated_at']
-                )
-            return None
-        finally:
-            conn.close()
+            cursor.row_factory = _order_row_factory
+            cursor.execute(_SELECT_BY_ID_SQL, (order_id,))
+            return cursor.fetchone()
 
+    @_offload
     def get_stop_losses_by_symbol(self, symbol: str) -> List[StopLossOrder]:
         """获取指定交易对的所有止损订单"""
-        conn = self.get_connection()
-        try:
+        with self._reader() as conn:
             cursor = conn.cursor()
-            cursor.execute('SELECT * FROM stop_loss_orders WHERE symbol = ?', (symbol,))
-            rows = cursor.fetchall()
-            return [StopLossOrder(
-                id=row['id'], symbol=row['symbol'], side=row['side'],
-                stop_price=row['stop_price'], timeframe=row['timeframe'],
-                quantity=row['quantity'], created_at=row['created_at'],
-                updated_at=row['updated_at']
-            ) for row in rows]
-        finally:
-            conn.close()
+            cursor.row_factory = _order_row_factory
+            cursor.execute(_SELECT_BY_SYMBOL_SQL, (symbol,))
+            return cursor.fetchall()
 
+    @_offload
     def get_all_stop_losses(self) -> List[StopLossOrder]:
         """获取所有止损订单"""
-        conn = self.get_connection()
-        try:
+        with self._reader() as conn:
             cursor = conn.cursor()
-            cursor.execute('SELECT * FROM stop_loss_orders ORDER BY created_at DESC')
-            rows = cursor.fetchall()
-            return [StopLossOrder(
-                id=row['id'], symbol=row['symbol'], side=row['side'],
-                stop_price=row['stop_price'], timeframe=row['timeframe'],
-                quantity=row['quantity'], created_at=row['created_at'],
-                updated_at=row['updated_at']
-            ) for row in rows]
-        finally:
-            conn.close()
+            cursor.row_factory = _order_row_factory
+            cursor.execute(_SELECT_ALL_SQL)
+            return cursor.fetchall()
 
+    @_offload
     def delete_stop_loss(self, order_id: int) -> bool:
         """删除止损订单"""
-        conn = self.get_connection()
         try:
-            cursor = conn.cursor()
-            cursor.execute('DELETE FROM stop_loss_orders WHERE id = ?', (order_id,))
-            deleted = cursor.rowcount > 0
-            conn.commit()
-            if deleted:
-                logger.info(f"删除止损订单: ID {order_id}")
-            return deleted
+            with self._transaction() as conn:
+                deleted = conn.execute('DELETE FROM stop_loss_orders WHERE id = ?', (order_id,)).rowcount > 0
         except Exception as e:
-            conn.rollback()
-            logger.error(f"删除止损订单失败: {e}")
+            logger.error("删除止损订单失败: %s", e)
             raise
-        finally:
-            conn.close()
+        if deleted:
+            logger.info("删除止损订单: ID %s", order_id)
+        return deleted
 
+    @_offload
     def delete_stop_losses_by_symbol(self, symbol: str) -> int:
         """删除指定交易对的所有止损订单"""
-        conn = self.get_connection()
         try:
-            cursor = conn.cursor()
-            cursor.execute('DELETE FROM stop_loss_orders WHERE symbol = ?', (symbol,))
-            count = cursor.rowcount
-            conn.commit()
-            if count > 0:
-                logger.info(f"删除 {symbol} 的 {count} 个止损订单")
-            return count
+            with self._transaction() as conn:
+                count = conn.execute('DELETE FROM stop_loss_orders WHERE symbol = ?', (symbol,)).rowcount
         except Exception as e:
-            conn.rollback()
-            logger.error(f"删除止损订单失败: {e}")
+            logger.error("删除止损订单失败: %s", e)
             raise
-        finally:
-            conn.close()
+        if count > 0:
+            logger.info("删除 %s 的 %s 个止损订单", symbol, count)
+        return count
 
-    def update_stop_loss(self, order_id: int, stop_price: Optional[float] = None,
-                        timeframe: Optional[str] = None, quantity: Optional[float] = None) -> bool:
-        """更新止损订单"""
-        conn = self.get_connection()
+    @_offload
+    def delete_stop_losses_bulk(self, order_ids: List[int]) -> Dict[Tuple[str, str], int]:
+        """批量删除止损订单（单个事务、单条 DELETE），返回按 (symbol, side) 统计的删除数量"""
+        if not order_ids:
+            return {}
+        placeholders = ', '.join('?' * len(order_ids))
+        params = list(order_ids)
         try:
-            cursor = conn.cursor()
-            updates = []
-            params = []
-
-            if stop_price is not None:
-                updates.append('stop_price = ?')
-                params.append(stop_price)
-            if timeframe is not None:
-                updates.append('timeframe = ?')
-                params.append(timeframe)
-            if quantity is not None:
-                updates.append('quantity = ?')
-                params.append(quantity)
-            if not updates:
-                return False
-
-            updates.append('updated_at = CURRENT_TIMESTAMP')
-            params.append(order_id)
-
-            query = f"UPDATE stop_loss_orders SET {', '.join(updates)} WHERE id = ?"
-            cursor.execute(query, params)
-            updated = cursor.rowcount > 0
-            conn.commit()
-            if updated:
-                logger.info(f"更新止损订单: ID {order_id}")
-            return updated
+            with self._transaction() as conn:
+                # 同一事务内先按交易对+方向统计再删除，结果与实际删除的行一致
+                counts = {
+                    (symbol, side): count for symbol, side, count in conn.execute(
+                        f'SELECT symbol, side, COUNT(*) FROM stop_loss_orders '
+                        f'WHERE id IN ({placeholders}) GROUP BY symbol, side', params
+                    )
+                }
+                conn.execute(f'DELETE FROM stop_loss_orders WHERE id IN ({placeholders})', params)
         except Exception as e:
-            conn.rollback()
-            logger.error(f"更新止损订单失败: {e}")
+            logger.error("批量删除止损订单失败: %s", e)
             raise
-        finally:
-            conn.close()
+        if counts:
+            logger.info("批量删除 %s 个止损订单: ID %s", sum(counts.values()), params)
+        return counts
+
+    @_offload
+    def update_stop_loss(self, order_id: int, stop_price: Optional[float] = None,
+                        timeframe: Optional[str] = None, quantity: Optional[float] = None) -> Optional[StopLossOrder]:
+        """更新止损订单，返回更新后的订单（订单不存在或没有要更新的字段时返回 None）"""
+        values = (stop_price, timeframe, quantity)
+        mask = (stop_price is not None) | (timeframe is not None) << 1 | (quantity is not None) << 2
+        if not mask:
+            return None
+        params = [value for value in values if value is not None]
+        params.append(order_id)
 
+        try:
+            with self._transaction() as conn:
+                cursor = conn.cursor()
+                cursor.row_factory = _order_row_factory
+                cursor.execute(_UPDATE_SQL[mask], params)
+                if _HAS_RETURNING:
+                    # 取完 RETURNING 结果，语句执行结束后再提交
+                    rows = cursor.fetchall()
+                    order = rows[0] if rows else None
+                elif cursor.rowcount > 0:
+                    # 旧版 SQLite：同一事务内回读
+                    order = cursor.execute(_SELECT_BY_ID_SQL, (order_id,)).fetchone()
+                else:
+                    order = None
+        except Exception as e:
+            logger.error("更新止损订单失败: %s", e)
+            raise
+        if order:
+            logger.info("更新止损订单: ID %s", order_id)
+        return order
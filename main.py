@@ -104,10 +104,11 @@ class TradingBot:
     def setup_callbacks(self):
         """设置回调函数"""
         # 币安客户端的回调
-        self.binance_client.on_position_update = self.on_position_update
+        self.binance_client.on_position_update_batch = self.on_position_update_batch
         self.binance_client.on_position_closed = self.on_position_closed
         self.binance_client.on_order_update = self.on_order_update
         self.binance_client.on_account_update = self.on_account_update
+        self.binance_client.on_positions_reconciled = self.on_positions_reconciled
         
         # 止损管理器的回调
         self.stop_loss_manager.on_stop_loss_triggered = self.on_stop_loss_triggered
@@ -115,16 +116,23 @@ class TradingBot:
         
         logger.info("回调函数设置完成")
 
-    async def on_position_update(self, position):
-        """持仓更新回调（开仓或持仓变化）"""
-        logger.info(f"持仓更新: {position}")
-        await self.telegram_bot.notify_position_update(position)
+    async def on_position_update_batch(self, positions):
+        """持仓批量更新回调（同一账户事件内的开仓或持仓变化）"""
+        for position in positions:
+            logger.info(f"持仓更新: {position}")
+        self.stop_loss_manager.mark_positions_dirty()
+        await self.telegram_bot.notify_position_updates(positions)
 
     async def on_position_closed(self, data):
         """平仓回调"""
         logger.info(f"持仓已平仓: {data}")
+        self.stop_loss_manager.mark_positions_dirty()
         await self.telegram_bot.notify_position_closed(data)
 
+    async def on_positions_reconciled(self):
+        """用户数据流重连对账完成回调：断线期间可能漏掉持仓事件，立即重新检查持仓"""
+        self.stop_loss_manager.mark_positions_dirty()
+
     async def on_order_update(self, order):
         """订单更新回调"""
         logger.info(f"订单更新: {order}")
@@ -132,7 +140,7 @@ class TradingBot:
 
     async def on_account_update(self, data):
         """账户更新回调"""
-        logger.debug(f"账户更新: {data}")
+        logger.debug("账户更新: %s", data)
 
     async def on_stop_loss_triggered(self, data):
         """止损触发回调"""
@@ -160,6 +168,9 @@ class TradingBot:
             # 设置回调
             self.setup_callbacks()
             
+            # 创建币安 REST 共享会话（后续所有请求复用）
+            await self.binance_client.init_session()
+            
             # 启动 Telegram Bot
             await self.telegram_bot.start()
             await self.telegram_bot.send_message("🚀 交易机器人已启动！")
@@ -167,11 +178,9 @@ class TradingBot:
             # 启动止损管理器
             await self.stop_loss_manager.start()
             
-            # 初始化持仓缓存（避免首次更新时误判为开仓）
-            await self.initialize_position_cache()
-            
-            # 初始化订单缓存（避免启动时误判为新订单）
-            await self.initialize_order_cache()
+            # 初始化持仓缓存（避免首次更新时误判为开仓）和订单缓存（避免启动时误判为新订单）
+            # 两者互不依赖，并发请求
+            await asyncio.gather(self.initialize_position_cache(), self.initialize_order_cache())
             
             # 启动币安 WebSocket 用户数据流
             asyncio.create_task(self.binance_client.start_user_data_stream())
@@ -204,8 +213,8 @@ class TradingBot:
             for pos in positions:
                 # 根据方向设置正负值
                 position_amt = pos['position_amt'] if pos['side'] == 'LONG' else -pos['position_amt']
-                # 使用 symbol_side 组合作为key
-                position_key = f"{pos['symbol']}_{pos['side']}"
+                # 使用 (symbol, side) 组合作为key
+                position_key = (pos['symbol'], pos['side'])
                 self.binance_client.position_cache[position_key] = position_amt
             logger.info(f"持仓缓存初始化完成，当前持仓数: {len(positions)}")
         except Exception as e:
@@ -225,33 +234,25 @@ class TradingBot:
     async def send_startup_info(self):
         """发送启动信息"""
         try:
-            # 获取当前持仓
-            positions = await self.binance_client.get_positions()
-            
-            # 获取止损订单
-            stop_losses = self.database.get_all_stop_losses()
-            
-            info_text = "📊 启动信息\n\n"
+            # 并发获取当前持仓和止损订单
+            positions, stop_losses = await asyncio.gather(
+                self.binance_client.get_positions(),
+                self.database.get_all_stop_losses()
+            )
             
             # 持仓信息
-            if positions:
-                info_text += f"持仓数量: {len(positions)}\n"
-                for pos in positions:
-                    info_text += f"  • {pos['symbol']} {pos['side']}\n"
-            else:
-                info_text += "持仓数量: 0\n"
-            
-            info_text += "\n"
+            parts = ["📊 启动信息\n\n", f"持仓数量: {len(positions)}\n"]
+            parts.extend(f"  • {pos['symbol']} {pos['side']}\n" for pos in positions)
+            parts.append("\n")
             
             # 止损订单信息
-            if stop_losses:
-                info_text += f"止损订单: {len(stop_losses)}\n"
-                for order in stop_losses:
-                    info_text += f"  • {order.symbol} {order.side} @ {order.stop_price} [{order.timeframe}]\n"
-            else:
-                info_text += "止损订单: 0\n"
+            parts.append(f"止损订单: {len(stop_losses)}\n")
+            parts.extend(
+                f"  • {order.symbol} {order.side} @ {order.stop_price} [{order.timeframe}]\n"
+                for order in stop_losses
+            )
             
-            await self.telegram_bot.send_message(info_text)
+            await self.telegram_bot.send_message("".join(parts))
             
         except Exception as e:
             logger.error(f"发送启动信息失败: {e}")
@@ -292,6 +293,13 @@ class TradingBot:
                 except Exception as e:
                     logger.warning(f"停止 Telegram Bot 时出错: {e}")
             
+            # 关闭数据库连接（放在最后，确保其他组件停止前仍可访问数据库）
+            if self.database:
+                try:
+                    self.database.close()
+                except Exception as e:
+                    logger.warning(f"关闭数据库时出错: {e}")
+            
             logger.info("所有组件已关闭")
             
         except Exception as e:
@@ -329,6 +337,13 @@ async def main():
 
 
 if __name__ == '__main__':
+    # 优先使用 uvloop（libuv 实现的事件循环，WebSocket/REST 收发更快），未安装（如 Windows）时使用默认事件循环
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
@@ -4,48 +4,101 @@
 """
 import asyncio
 import logging
-from typing import Dict, List, Callable, Optional
+import time
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple
 from datetime import datetime
 from database import Database, StopLossOrder
 from binance_client import BinanceClient
 
 logger = logging.getLogger(__name__)
 
+# K线周期对应的秒数（只读，模块加载时构造一次）
+_TF_SECONDS: Mapping[str, int] = MappingProxyType({
+    '1m': 60,
+    '3m': 180,
+    '5m': 300,
+    '15m': 900,
+    '30m': 1800,
+    '1h': 3600,
+    '2h': 7200,
+    '4h': 14400,
+    '6h': 21600,
+    '8h': 28800,
+    '12h': 43200,
+    '1d': 86400
+})
+_TF_SECONDS_GET = _TF_SECONDS.get
+
 
 class StopLossManager:
     """止损管理器"""
+
+    # K线收盘后超过该秒数仍未收到 WebSocket 推送（断线/刚订阅），改用 REST 补拉
+    KLINE_PUSH_TIMEOUT = 10
+    # 内存止损订单与数据库的兜底对账间隔（秒），用于发现绕过本管理器对数据库的修改
+    ORDER_RECONCILE_INTERVAL = 300
+    # 评估通知的合并等待时间（秒），以便把同一周期多个币种的评估合并为一条消息
+    EVALUATION_BATCH_DELAY = 8
+    # 停机时等待进行中的止损下单完成的最长时间（秒），超时后才强制取消
+    SHUTDOWN_TIMEOUT = 10
+    # 没有持仓变更事件时的兜底持仓检查间隔（秒）；用户数据流重连后另会立即检查一次
+    POSITION_CHECK_FALLBACK = 300
+    # 持仓检查失败后的重试间隔（秒）
+    POSITION_CHECK_RETRY_DELAY = 30
+    # 添加止损订单时可直接复用的持仓缓存最长时间（秒）
+    POSITION_CACHE_MAX_AGE = 2
     
     def __init__(self, binance_client: BinanceClient, database: Database, enable_evaluation_notification: bool = True):
         self.binance_client = binance_client
         self.database = database
         self.enable_evaluation_notification = enable_evaluation_notification
         
-        # 存储每个交易对最新的K线收盘时间
-        self.last_kline_close_time = {}
+        # 存储每个交易对周期最新处理过的K线收盘时间
+        self.last_kline_close_time: Dict[Tuple[str, str], int] = {}  # {(symbol, timeframe): close_time}
         
         # 回调函数
         self.on_stop_loss_triggered = None
         self.on_evaluation_notification = None
         
-        # 监控任务
-        self.monitoring_tasks = {}
+        # 已收盘K线事件队列：由K线流回调写入，单个分发任务顺序消费
+        # 回调只入队不做处理，下单等耗时操作不会阻塞 WebSocket 读取
+        self._kline_queue = asyncio.Queue()
         
-        # 当前持仓缓存
-        self.current_positions = {}
+        # 当前持仓缓存（双向持仓，与 BinanceClient.position_cache 一样以 (symbol, side) 为key）
+        self.current_positions: Dict[Tuple[str, str], Dict] = {}
         
         # 运行状态
         self.running = False
+
+        # 持仓变更标记：用户数据流推送持仓变化时置位，唤醒持仓检查任务
+        self._positions_dirty = asyncio.Event()
+        # 持仓变更计数：每次标记加一，用于判断进行中的拉取是否早于最近一次变更
+        self._positions_dirty_seq = 0
+        # 持仓拉取：并发调用共享同一次进行中的请求，并记录最近一次拉取完成的时间（单调时钟）
+        self._positions_fetch: Optional[asyncio.Task] = None
+        self._positions_fetch_seq = 0  # 进行中的拉取开始时的变更计数
+        self._positions_fetched_at: Optional[float] = None
         
-        # 用于按周期分组收集评估信息的字典
-        # key: timeframe, value: list of evaluation data
-        self.pending_evaluations = {}
-        
-        # 用于跟踪每个周期是否已经有发送任务在运行
-        # key: timeframe, value: bool
-        self.evaluation_sending_tasks = {}
+        # 按周期分组的评估信息队列，每个周期一个常驻发送任务消费
+        # key: timeframe, value: asyncio.Queue（元素为一个交易对的评估列表）
+        self._evaluation_queues: Dict[str, asyncio.Queue] = {}
 
         # 后台任务注册表（用于优雅停机）
         self._background_tasks = set()
+        # 进行中的止损下单任务（停机时先等待完成，不随后台任务直接取消）
+        self._executing_tasks = set()
+
+        # 止损订单的内存权威副本：按 (symbol, timeframe, side) 分组
+        # 启动时从数据库加载一次，之后所有增删改都经本管理器同时更新内存和数据库，
+        # 监控路径只读内存，不再查询数据库（数据库仅负责持久化，重启时恢复）
+        # 分组列表按写时复制更新，正在遍历旧列表的评估不受影响
+        self._order_groups: Dict[Tuple[str, str, str], List[StopLossOrder]] = {}
+        # 止损订单写锁：每次修改从更新内存到数据库写入完成都持有该锁，
+        # 对账重新加载时也持有，避免读到写入一半的状态（如已移出内存但数据库尚未删除的订单）
+        self._order_write_lock = asyncio.Lock()
+        # 内存副本是否已完成首次加载（加载前查询回退到数据库）
+        self._orders_loaded = False
 
     def _track_task(self, coro):
         """创建并跟踪后台任务"""
@@ -54,140 +107,235 @@ class StopLossManager:
         task.add_done_callback(self._background_tasks.discard)
         return task
 
+    async def _load_orders(self) -> int:
+        """从数据库加载全部止损订单到内存，返回订单数（启动和定期对账时调用）"""
+        async with self._order_write_lock:
+            order_groups = {}
+            all_stop_losses = await self.database.get_all_stop_losses()
+            for order in all_stop_losses:
+                order_groups.setdefault((order.symbol, order.timeframe, order.side), []).append(order)
+            self._order_groups = order_groups
+            self._orders_loaded = True
+        return len(all_stop_losses)
+
+    async def _reconcile_orders_loop(self):
+        """定期从数据库重新加载止损订单，兜底同步内存副本"""
+        while self.running:
+            try:
+                await asyncio.sleep(self.ORDER_RECONCILE_INTERVAL)
+
+                if not self.running:
+                    break
+
+                before = sum(len(orders) for orders in self._order_groups.values())
+                after = await self._load_orders()
+                if after != before:
+                    logger.warning("止损订单对账: 内存 %s 个，数据库 %s 个，已按数据库重新加载", before, after)
+
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error("止损订单对账时出错: %s", e)
+
+    def _cache_order(self, order: StopLossOrder):
+        """把止损订单加入内存分组"""
+        key = (order.symbol, order.timeframe, order.side)
+        self._order_groups[key] = self._order_groups.get(key, []) + [order]
+
+    def _uncache_orders(self, order_ids):
+        """从内存分组中移除止损订单，分组为空时删除该分组"""
+        order_ids = set(order_ids)
+        for key, orders in list(self._order_groups.items()):
+            remaining = [order for order in orders if order.id not in order_ids]
+            if len(remaining) == len(orders):
+                continue
+            if remaining:
+                self._order_groups[key] = remaining
+            else:
+                del self._order_groups[key]
+
     async def start(self):
         """启动止损管理器"""
         logger.info("启动止损管理器")
         self.running = True
         
         # 立即初始化持仓缓存（避免监控任务启动时缓存为空）
-        # 使用 symbol_side 组合作为key，支持双向持仓
+        # 使用 (symbol, side) 作为key，支持双向持仓
         try:
-            positions = await self.binance_client.get_positions()
-            self.current_positions = {f"{pos['symbol']}_{pos['side']}": pos for pos in positions}
-            logger.info(f"止损管理器持仓缓存初始化完成，当前持仓数: {len(positions)}")
+            positions = await self._refresh_positions()
+            logger.info("止损管理器持仓缓存初始化完成，当前持仓数: %s", len(positions))
         except Exception as e:
-            logger.warning(f"初始化止损管理器持仓缓存失败: {e}")
-            self.current_positions = {}
+            logger.warning("初始化止损管理器持仓缓存失败: %s", e)
+            self.current_positions.clear()
         
+        # 加载止损订单（之后以内存为准）
+        logger.info("已加载 %s 个止损订单", await self._load_orders())
+
         # 为已有止损订单初始化K线基准时间（避免重启后立刻评估历史已收盘K线）
         await self._init_kline_baselines()
 
+        # 启动K线推送流及其分发任务（纳入生命周期管理）
+        self.binance_client.on_kline_closed = self._on_kline_closed
+        self._track_task(self.binance_client.start_kline_stream())
+        self._track_task(self._dispatch_klines())
+
         # 启动持仓检查任务（纳入生命周期管理）
         self._track_task(self._check_positions_loop())
 
         # 启动止损监控任务（纳入生命周期管理）
         self._track_task(self._monitor_stop_losses())
+
+        # 启动止损订单对账任务（纳入生命周期管理）
+        self._track_task(self._reconcile_orders_loop())
     
     async def _init_kline_baselines(self):
         """为已有止损订单初始化K线基准时间，避免重启后立刻评估历史已收盘K线"""
-        all_stop_losses = self.database.get_all_stop_losses()
-        if not all_stop_losses:
+        order_groups = self._order_groups
+        if not order_groups:
             return
 
         # 按 (symbol, timeframe) 去重
-        kline_keys = set()
-        for order in all_stop_losses:
-            kline_keys.add((order.symbol, order.timeframe))
+        kline_keys = {(symbol, timeframe) for symbol, timeframe, _ in order_groups}
+
+        # 所有组合的K线并发获取，服务器时间只取一次
+        klines_by_pair = await self.binance_client.get_klines_multi(kline_keys, limit=2)
+        current_time = await self.binance_client.get_server_time()
 
         initialized = 0
-        for symbol, timeframe in kline_keys:
-            key = f"{symbol}_{timeframe}"
-            try:
-                klines = await self.binance_client.get_kline_data(symbol, timeframe, limit=2)
-                current_time = await self.binance_client.get_server_time()
-                if klines:
-                    for kline in klines:
-                        if current_time >= kline['close_time']:
-                            self.last_kline_close_time[key] = kline['close_time']
-                    initialized += 1
-            except Exception as e:
-                logger.warning(f"初始化 {key} K线基准时间失败: {e}")
+        for key, klines in klines_by_pair.items():
+            if klines:
+                for kline in klines:
+                    if current_time >= kline['close_time']:
+                        self.last_kline_close_time[key] = kline['close_time']
+                initialized += 1
 
         if initialized > 0:
-            logger.info(f"已初始化 {initialized} 个交易对的K线基准时间，重启后仅评估新收盘K线")
+            logger.info("已初始化 %s 个交易对的K线基准时间，重启后仅评估新收盘K线", initialized)
 
     async def stop(self):
         """停止止损管理器"""
         logger.info("停止止损管理器")
         self.running = False
 
-        # 取消所有被追踪的后台任务
+        # 先等待进行中的止损下单完成：下单与删除止损记录之间被打断会导致交易所与数据库不一致
+        if self._executing_tasks:
+            logger.info("等待 %s 个进行中的止损下单完成...", len(self._executing_tasks))
+            _, pending = await asyncio.wait(self._executing_tasks, timeout=self.SHUTDOWN_TIMEOUT)
+            if pending:
+                logger.warning("%s 个止损下单在 %s 秒内未完成，强制取消", len(pending), self.SHUTDOWN_TIMEOUT)
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        # 取消所有被追踪的后台任务（统一一条取消路径）
+        # 任务在收尾阶段可能再派生新任务，循环到注册表为空为止；完成回调会自动移出注册表
         if self._background_tasks:
-            logger.info(f"正在取消 {len(self._background_tasks)} 个止损监控任务...")
-            for task in list(self._background_tasks):
+            logger.info("正在取消 %s 个止损监控任务...", len(self._background_tasks))
+        while self._background_tasks:
+            tasks = list(self._background_tasks)
+            for task in tasks:
                 task.cancel()
-            await asyncio.gather(*self._background_tasks, return_exceptions=True)
-            self._background_tasks.clear()
-
-        # 取消所有按交易对分组的监控任务
-        if self.monitoring_tasks:
-            logger.info(f"正在取消 {len(self.monitoring_tasks)} 个符号监控任务...")
-            for key, task in list(self.monitoring_tasks.items()):
-                if not task.done():
-                    task.cancel()
-            await asyncio.gather(
-                *[t for t in self.monitoring_tasks.values() if not t.done()],
-                return_exceptions=True
-            )
-            self.monitoring_tasks.clear()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        self._evaluation_queues.clear()
 
         logger.info("止损管理器已完全停止")
 
+    async def _refresh_positions(self, max_age: float = 0, min_seq: int = 0) -> Dict[Tuple[str, str], Dict]:
+        """拉取持仓并原地更新 current_positions，返回该字典
+
+        max_age 秒内拉取过则直接返回缓存；同时有多个调用时只发一次请求，
+        但开始于第 min_seq 次持仓变更之前的请求不复用（其结果可能不含该变更）
+        """
+        if max_age and self._positions_fetched_at is not None \
+                and time.monotonic() - self._positions_fetched_at < max_age:
+            return self.current_positions
+        while True:
+            fetch = self._positions_fetch
+            if fetch is None:
+                self._positions_fetch_seq = self._positions_dirty_seq
+                fetch = self._positions_fetch = asyncio.create_task(self._fetch_positions())
+            elif self._positions_fetch_seq < min_seq:
+                # 进行中的请求早于持仓变更：等它结束（不关心结果）后重新拉取
+                await asyncio.wait([fetch])
+                continue
+            # shield：某个调用方被取消时不影响其他等待同一请求的调用方
+            return await asyncio.shield(fetch)
+
+    async def _fetch_positions(self) -> Dict[Tuple[str, str], Dict]:
+        """请求持仓并原地更新缓存：只删除已消失的持仓、覆盖其余持仓，始终是同一个字典对象"""
+        try:
+            positions = await self.binance_client.get_positions()
+            latest_positions = {(pos['symbol'], pos['side']): pos for pos in positions}
+            current_positions = self.current_positions
+            for position_key in current_positions.keys() - latest_positions.keys():
+                del current_positions[position_key]
+            current_positions.update(latest_positions)
+            self._positions_fetched_at = time.monotonic()
+            return current_positions
+        finally:
+            self._positions_fetch = None
+
+    def mark_positions_dirty(self):
+        """通知持仓已变化（由用户数据流的持仓事件触发），持仓检查任务会立即刷新"""
+        self._positions_dirty_seq += 1
+        self._positions_dirty.set()
+
     async def _check_positions_loop(self):
-        """定期检查持仓，清理已平仓交易对的止损订单"""
+        """持仓变化时检查持仓，清理已平仓交易对的止损订单（无事件时按兜底间隔检查）"""
         consecutive_errors = 0
         max_consecutive_errors = 5
         
         while self.running:
             try:
-                await asyncio.sleep(30)  # 每30秒检查一次
+                try:
+                    await asyncio.wait_for(self._positions_dirty.wait(), timeout=self.POSITION_CHECK_FALLBACK)
+                except asyncio.TimeoutError:
+                    pass  # 兜底检查（断线期间可能漏掉事件）
+                dirty_seq = self._positions_dirty_seq
+                self._positions_dirty.clear()
                 
                 if not self.running:
                     break
                 
                 try:
-                    # 获取当前所有持仓
-                    positions = await self.binance_client.get_positions()
+                    # 获取当前所有持仓（原地更新持仓缓存）
+                    current_positions = await self._refresh_positions(min_seq=dirty_seq)
                     
                     # 重置错误计数
                     consecutive_errors = 0
                     
-                    # 更新持仓缓存（使用 symbol_side 组合作为key，支持双向持仓）
-                    self.current_positions = {f"{pos['symbol']}_{pos['side']}": pos for pos in positions}
-                    
-                    # 获取数据库中所有的止损订单
-                    all_stop_losses = self.database.get_all_stop_losses()
+                    order_groups = self._order_groups
                     
-                    # 创建当前持仓的key集合（symbol_side组合）
-                    current_position_keys = set(self.current_positions.keys())
+                    # 按交易对+方向收集需要清理的订单ID（持仓已不存在的）
+                    cleaned_positions = {}
+                    for (symbol, _, side), orders in order_groups.items():
+                        position_key = (symbol, side)
+                        if position_key in current_positions:
+                            continue
+                        info = cleaned_positions.setdefault(
+                            position_key, {'symbol': symbol, 'side': side, 'order_ids': []}
+                        )
+                        info['order_ids'].extend(order.id for order in orders)
                     
-                    # 收集需要清理的订单（去重，避免同一交易对的多个订单重复处理）
-                    orders_to_clean = []
-                    for order in all_stop_losses:
-                        order_key = f"{order.symbol}_{order.side}"
-                        if order_key not in current_position_keys:
-                            orders_to_clean.append(order)
+                    # 所有需要清理的订单：先移出内存（立即停止评估），再用一条语句统一删除
+                    deleted_counts = {}
+                    if cleaned_positions:
+                        order_ids = [order_id for info in cleaned_positions.values() for order_id in info['order_ids']]
+                        async with self._order_write_lock:
+                            self._uncache_orders(order_ids)
+                            deleted_counts = await self.database.delete_stop_losses_bulk(order_ids)
                     
-                    # 按交易对+方向分组统计
-                    cleaned_positions = {}
-                    for order in orders_to_clean:
-                        order_key = f"{order.symbol}_{order.side}"
-                        if order_key not in cleaned_positions:
-                            cleaned_positions[order_key] = {'symbol': order.symbol, 'side': order.side, 'count': 0}
-                        cleaned_positions[order_key]['count'] += 1
+                    # 已无止损订单的交易对周期不再需要K线收盘时间，从内存中清理
+                    active_pairs = {(symbol, timeframe) for symbol, timeframe, _ in self._order_groups}
+                    for key in self.last_kline_close_time.keys() - active_pairs:
+                        del self.last_kline_close_time[key]
                     
-                    # 对每个需要清理的持仓方向，删除订单并发送通知
-                    for position_key, info in cleaned_positions.items():
-                        # 删除该交易对+方向的所有止损订单
-                        # 注意：需要修改数据库删除方法以支持按方向删除
-                        deleted_count = 0
-                        for order in all_stop_losses:
-                            if order.symbol == info['symbol'] and order.side == info['side']:
-                                if self.database.delete_stop_loss(order.id):
-                                    deleted_count += 1
-                        
+                    # 按持仓方向发送通知
+                    for info in cleaned_positions.values():
+                        deleted_count = deleted_counts.get((info['symbol'], info['side']), 0)
                         if deleted_count > 0:
-                            logger.info(f"清理已平仓持仓 {info['symbol']} {info['side']} 的 {deleted_count} 个止损订单")
+                            logger.info("清理已平仓持仓 %s %s 的 %s 个止损订单", info['symbol'], info['side'], deleted_count)
                             
                             if self.on_stop_loss_triggered:
                                 await self.on_stop_loss_triggered({
@@ -200,21 +348,25 @@ class StopLossManager:
                                 
                 except Exception as e:
                     consecutive_errors += 1
-                    logger.error(f"检查持仓时出错 ({consecutive_errors}/{max_consecutive_errors}): {e}")
+                    logger.error("检查持仓时出错 (%s/%s): %s", consecutive_errors, max_consecutive_errors, e)
                     
                     # 如果连续错误次数过多，等待更长时间
                     if consecutive_errors >= max_consecutive_errors:
-                        logger.warning(f"持仓检查连续失败 {consecutive_errors} 次，等待60秒后继续...")
+                        logger.warning("持仓检查连续失败 %s 次，等待60秒后继续...", consecutive_errors)
                         await asyncio.sleep(60)
                         consecutive_errors = 0
+                    else:
+                        await asyncio.sleep(self.POSITION_CHECK_RETRY_DELAY)
+                    # 失败后不等待下一次事件，直接重试
+                    self._positions_dirty.set()
                 
             except asyncio.CancelledError:
                 break
             except Exception as e:
-                logger.error(f"持仓检查循环异常: {e}")
+                logger.error("持仓检查循环异常: %s", e)
 
     async def _monitor_stop_losses(self):
-        """监控所有止损订单"""
+        """同步K线订阅，并为推送缺失的交易对周期用 REST 补拉已收盘K线"""
         while self.running:
             try:
                 await asyncio.sleep(5)  # 每5秒检查一次
@@ -222,164 +374,125 @@ class StopLossManager:
                 if not self.running:
                     break
                 
-                # 获取所有止损订单
-                all_stop_losses = self.database.get_all_stop_losses()
-                
-                # 按交易对、时间周期和方向分组（支持双向持仓）
-                monitoring_groups = {}
-                for order in all_stop_losses:
-                    key = f"{order.symbol}_{order.timeframe}_{order.side}"
-                    if key not in monitoring_groups:
-                        monitoring_groups[key] = []
-                    monitoring_groups[key].append(order)
-
-                # 为每个组创建监控任务
-                for key, orders in monitoring_groups.items():
-                    if key not in self.monitoring_tasks or self.monitoring_tasks[key].done():
-                        symbol = orders[0].symbol
-                        timeframe = orders[0].timeframe
-                        side = orders[0].side
-                        task = asyncio.create_task(
-                            self._monitor_symbol_timeframe(symbol, timeframe, side)
-                        )
-                        self.monitoring_tasks[key] = task
+                # 按交易对、时间周期和方向分组的止损订单（支持双向持仓）
+                order_groups = self._order_groups
+
+                # 只订阅仍有持仓的 (symbol, timeframe)，无持仓的订单由持仓检查任务清理
+                kline_pairs = {
+                    (symbol, timeframe) for symbol, timeframe, side in order_groups
+                    if (symbol, side) in self.current_positions
+                }
+                await self.binance_client.update_kline_subscriptions(kline_pairs)
+
+                # 正常情况下收盘K线由推送送达；超时仍未收到时（断线重连期间等）用 REST 补拉
+                # 需要补拉的组合一次并发获取（断线重连后通常是全部组合同时超时）
+                current_time = self.binance_client.estimated_server_time()
+                stale_pairs = []
+                for symbol, timeframe in kline_pairs:
+                    last_close = self.last_kline_close_time.get((symbol, timeframe))
+                    if last_close is not None:
+                        deadline = last_close + (self._timeframe_to_seconds(timeframe) + self.KLINE_PUSH_TIMEOUT) * 1000
+                        if current_time < deadline:
+                            continue
+                    stale_pairs.append((symbol, timeframe))
+
+                if stale_pairs:
+                    klines_by_pair = await self.binance_client.get_klines_multi(stale_pairs, limit=2)
+                    for (symbol, timeframe), klines in klines_by_pair.items():
+                        # 最新的一根可能还在进行中，只取已完全收盘的K线
+                        closed = [kline for kline in klines if current_time >= kline['close_time']]
+                        if closed:
+                            self._kline_queue.put_nowait((symbol, timeframe, closed[-1]))
                 
             except asyncio.CancelledError:
                 break
             except Exception as e:
-                logger.error(f"监控止损订单时出错: {e}")
+                logger.error("监控止损订单时出错: %s", e)
 
-    async def _monitor_symbol_timeframe(self, symbol: str, timeframe: str, side: str):
-        """监控特定交易对、时间周期和方向的止损"""
-        logger.info(f"开始监控 {symbol} {side} [{timeframe}] 的止损")
-        
-        # 转换时间周期为秒数
-        interval_seconds = self._timeframe_to_seconds(timeframe)
-        
-        consecutive_errors = 0
-        max_consecutive_errors = 5
-        
+    async def _on_kline_closed(self, symbol: str, timeframe: str, kline: Dict):
+        """K线流收盘回调：只入队，由分发任务处理"""
+        self._kline_queue.put_nowait((symbol, timeframe, kline))
+
+    async def _dispatch_klines(self):
+        """顺序消费已收盘K线事件（推送与 REST 补拉共用）"""
         while self.running:
             try:
-                # 获取该交易对、时间周期和方向的所有止损订单
-                all_orders = self.database.get_all_stop_losses()
-                orders = [o for o in all_orders
-                          if o.symbol == symbol and o.timeframe == timeframe and o.side == side]
-
-                if not orders:
-                    # 没有订单了，退出监控
-                    logger.info(f"停止监控 {symbol} {side} [{timeframe}]，无止损订单")
-                    break
-
-                # 检查是否有持仓（使用 symbol_side 组合检查）
-                position_key = f"{symbol}_{side}"
-                if position_key not in self.current_positions:
-                    logger.info(f"停止监控 {symbol} {side} [{timeframe}]，无持仓")
-                    break
-                
-                try:
-                    # 获取最近2根K线：最新的一根可能还在进行中，第二根是已收盘的
-                    # 我们应该评估已经完全收盘的K线，而不是正在进行中的K线
-                    klines = await self.binance_client.get_kline_data(symbol, timeframe, limit=2)
-                    
-                    # 重置错误计数
-                    consecutive_errors = 0
-                    
-                    if not klines:
-                        await asyncio.sleep(5)
-                        continue
-                    
-                    current_time = await self.binance_client.get_server_time()
-                    last_processed_close = self.last_kline_close_time.get(f"{symbol}_{timeframe}", 0)
-                    
-                    # 找出最近一根已经收盘且未处理过的K线
-                    kline_to_check = None
-                    
-                    for kline in klines:
-                        kline_close_time = kline['close_time']
-                        
-                        # 检查这根K线是否：1) 已收盘  2) 未处理过
-                        if current_time >= kline_close_time and kline_close_time > last_processed_close:
-                            kline_to_check = kline
-                            logger.info(
-                                f"{symbol} [{timeframe}] 找到待评估的已收盘K线: "
-                                f"开盘时间={datetime.fromtimestamp(kline['open_time']/1000).strftime('%H:%M:%S')}, "
-                                f"收盘时间={datetime.fromtimestamp(kline_close_time/1000).strftime('%H:%M:%S')}, "
-                                f"收盘价={kline['close']}"
-                            )
-                            break  # 只处理最近的一根
-                    
-                    # 处理找到的已收盘K线
-                    if kline_to_check:
-                        price = kline_to_check['close']
-                        check_close_time = kline_to_check['close_time']
-                        
-                        # 更新最后处理的收盘时间（避免重复处理）
-                        self.last_kline_close_time[f"{symbol}_{timeframe}"] = check_close_time
-                        
-                        # 收集评估信息（如果启用）
-                        if self.enable_evaluation_notification:
-                            await self._collect_evaluation(symbol, timeframe, price, orders)
-                        
-                        # 检查每个止损订单
-                        for order in orders:
-                            await self._check_stop_loss_trigger(order, price)
-                    
-                    # 等待一段时间再检查
-                    await asyncio.sleep(min(10, interval_seconds // 6))
-                    
-                except Exception as e:
-                    consecutive_errors += 1
-                    logger.error(f"监控 {symbol} {side} [{timeframe}] 时出错 ({consecutive_errors}/{max_consecutive_errors}): {e}")
-
-                    # 如果连续错误次数过多，等待更长时间
-                    if consecutive_errors >= max_consecutive_errors:
-                        logger.warning(f"{symbol} {side} [{timeframe}] 监控连续失败 {consecutive_errors} 次，等待30秒后继续...")
-                        await asyncio.sleep(30)
-                        consecutive_errors = 0
-                    else:
-                        await asyncio.sleep(5)
-                
+                symbol, timeframe, kline = await self._kline_queue.get()
+                await self._evaluate_closed_kline(symbol, timeframe, kline)
             except asyncio.CancelledError:
                 break
             except Exception as e:
-                if not self.running:
-                    break
-                logger.error(f"监控 {symbol} {side} [{timeframe}] 循环异常: {e}")
-                await asyncio.sleep(5)
+                logger.error("处理K线收盘事件时出错: %s", e)
 
-    async def _check_stop_loss_trigger(self, order: StopLossOrder, current_price: float):
-        """检查止损是否触发"""
-        triggered = False
-        
-        # 获取持仓信息（使用 symbol_side 组合）
-        position_key = f"{order.symbol}_{order.side}"
-        position = self.current_positions.get(position_key)
-        if not position:
-            logger.warning(f"止损订单 {order.id} 对应的持仓不存在: {order.symbol} {order.side}")
+    async def _evaluate_closed_kline(self, symbol: str, timeframe: str, kline: Dict):
+        """用一根已收盘K线评估该交易对周期下两个方向的止损订单"""
+        key = (symbol, timeframe)
+        kline_close_time = kline['close_time']
+
+        # 推送与 REST 补拉可能送达同一根K线，已处理过的直接跳过
+        if kline_close_time <= self.last_kline_close_time.get(key, 0):
             return
-        
-        # 判断是否触发止损
-        if order.side == 'LONG':
-            # 多头止损：当前价格 <= 止损价格
-            if current_price <= order.stop_price:
-                triggered = True
-        else:  # SHORT
-            # 空头止损：当前价格 >= 止损价格
-            if current_price >= order.stop_price:
-                triggered = True
-        
-        if triggered:
-            logger.warning(
-                f"止损触发！{order.symbol} {order.side} @ {current_price} "
-                f"(止损价: {order.stop_price}, 周期: {order.timeframe})"
+        self.last_kline_close_time[key] = kline_close_time
+
+        order_groups = self._order_groups
+        price = kline['close']
+        # 时间格式化参数会被提前求值，日志级别不输出时整体跳过
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                "%s [%s] K线已收盘: 开盘时间=%s, 收盘时间=%s, 收盘价=%s",
+                symbol, timeframe,
+                datetime.fromtimestamp(kline['open_time']/1000).strftime('%H:%M:%S'),
+                datetime.fromtimestamp(kline_close_time/1000).strftime('%H:%M:%S'),
+                price
             )
-            
-            # 执行止损
-            await self._execute_stop_loss(order, position, current_price)
+
+        for side in ('LONG', 'SHORT'):
+            orders = order_groups.get((symbol, timeframe, side))
+            if not orders:
+                continue
+            position = self.current_positions.get((symbol, side))
+            if not position:
+                continue
+
+            # 一次遍历完成评估与触发判断
+            # 多头止损：收盘价 <= 止损价；空头止损：收盘价 >= 止损价
+            is_long = side == 'LONG'
+            evaluations = []
+            triggered_orders = []
+            for order in orders:
+                should_trigger = price <= order.stop_price if is_long else price >= order.stop_price
+                if should_trigger:
+                    triggered_orders.append(order)
+                evaluations.append({
+                    'symbol': symbol,
+                    'side': side,
+                    'close_price': price,
+                    'stop_price': order.stop_price,
+                    'should_trigger': should_trigger,
+                    'order_id': order.id
+                })
+
+            # 收集评估信息（如果启用）
+            if self.enable_evaluation_notification:
+                self._queue_evaluations(symbol, timeframe, evaluations)
+
+            # 执行触发的止损
+            for order in triggered_orders:
+                logger.warning(
+                    "止损触发！%s %s @ %s (止损价: %s, 周期: %s)",
+                    order.symbol, order.side, price, order.stop_price, order.timeframe
+                )
+                await self._execute_stop_loss(order, position, price)
 
     async def _execute_stop_loss(self, order: StopLossOrder, position: Dict, trigger_price: float):
-        """执行止损（确认成交后才删除订单）"""
+        """执行止损：下单在独立任务中进行并 shield，调用方被取消（如停机）时下单与删除记录不会被拆开"""
+        task = asyncio.create_task(self._place_stop_loss_order(order, position, trigger_price))
+        self._executing_tasks.add(task)
+        task.add_done_callback(self._executing_tasks.discard)
+        await asyncio.shield(task)
+
+    async def _place_stop_loss_order(self, order: StopLossOrder, position: Dict, trigger_price: float):
+        """下市价单平仓（确认成交后才删除订单）"""
         try:
             # 确定平仓方向（多头平仓=卖出，空头平仓=买入）
             side = 'SELL' if order.side == 'LONG' else 'BUY'
@@ -387,8 +500,8 @@ class StopLossManager:
             quantity = order.quantity if order.quantity else position['position_amt']
 
             logger.info(
-                f"执行止损: {order.symbol} {side} {quantity} "
-                f"(持仓方向: {position_side}, 触发价: {trigger_price}, 止损价: {order.stop_price})"
+                "执行止损: %s %s %s (持仓方向: %s, 触发价: %s, 止损价: %s)",
+                order.symbol, side, quantity, position_side, trigger_price, order.stop_price
             )
 
             # 下市价单
@@ -399,26 +512,30 @@ class StopLossManager:
                 position_side=position_side
             )
 
-            logger.info(f"止损订单已提交: {result}")
+            logger.info("止损订单已提交: %s", result)
 
             # 确认订单状态：只有 FILLED 才删除止损记录
             order_status = result.get('status', '')
             if order_status == 'FILLED':
-                self.database.delete_stop_loss(order.id)
-                logger.info(f"止损订单 {order.id} 已成交，已从数据库删除")
+                async with self._order_write_lock:
+                    self._uncache_orders((order.id,))
+                    await self.database.delete_stop_loss(order.id)
+                logger.info("止损订单 %s 已成交，已从数据库删除", order.id)
             elif order_status in ('NEW', 'PARTIALLY_FILLED'):
                 # 市价单通常立即成交，但极端情况下可能部分成交
                 # 仍然删除止损记录，避免重复触发
-                self.database.delete_stop_loss(order.id)
+                async with self._order_write_lock:
+                    self._uncache_orders((order.id,))
+                    await self.database.delete_stop_loss(order.id)
                 logger.warning(
-                    f"止损订单 {order.id} 状态为 {order_status}，"
-                    f"已删除止损记录以避免重复触发"
+                    "止损订单 %s 状态为 %s，已删除止损记录以避免重复触发",
+                    order.id, order_status
                 )
             else:
                 # 异常状态（REJECTED/EXPIRED/CANCELED），保留止损记录
                 logger.error(
-                    f"止损订单 {order.id} 执行异常，状态: {order_status}，"
-                    f"保留止损记录以便下次重试"
+                    "止损订单 %s 执行异常，状态: %s，保留止损记录以便下次重试",
+                    order.id, order_status
                 )
 
             # 触发回调
@@ -431,7 +548,7 @@ class StopLossManager:
                 })
 
         except Exception as e:
-            logger.error(f"执行止损失败: {e}，保留止损记录以便下次重试")
+            logger.error("执行止损失败: %s，保留止损记录以便下次重试", e)
 
             if self.on_stop_loss_triggered:
                 await self.on_stop_loss_triggered({
@@ -442,120 +559,56 @@ class StopLossManager:
 
     def _timeframe_to_seconds(self, timeframe: str) -> int:
         """将时间周期转换为秒数"""
-        mapping = {
-            '1m': 60,
-            '3m': 180,
-            '5m': 300,
-            '15m': 900,
-            '30m': 1800,
-            '1h': 3600,
-            '2h': 7200,
-            '4h': 14400,
-            '6h': 21600,
-            '8h': 28800,
-            '12h': 43200,
-            '1d': 86400
-        }
-        return mapping.get(timeframe, 900)
-
-    async def _collect_evaluation(self, symbol: str, timeframe: str, close_price: float, orders: List[StopLossOrder]):
-        """收集评估信息"""
-        try:
-            # 为每个订单评估是否应该执行止损
-            evaluations = []
-            for order in orders:
-                # 获取对应方向的持仓信息（使用 symbol_side 组合）
-                position_key = f"{symbol}_{order.side}"
-                position = self.current_positions.get(position_key)
-                if not position:
-                    # 如果持仓不存在，跳过此订单的评估
-                    continue
-                
-                should_trigger = False
-                
-                # 判断是否应该触发止损
-                if order.side == 'LONG':
-                    # 多头止损：当前价格 <= 止损价格
-                    should_trigger = close_price <= order.stop_price
-                else:  # SHORT
-                    # 空头止损：当前价格 >= 止损价格
-                    should_trigger = close_price >= order.stop_price
-                
-                evaluations.append({
-                    'symbol': symbol,
-                    'side': order.side,
-                    'close_price': close_price,
-                    'stop_price': order.stop_price,
-                    'should_trigger': should_trigger,
-                    'order_id': order.id
-                })
-            
-            # 如果没有有效的评估信息，直接返回
-            if not evaluations:
-                return
-            
-            # 按周期分组存储评估信息
-            if timeframe not in self.pending_evaluations:
-                self.pending_evaluations[timeframe] = []
-            
-            # 添加评估信息
-            self.pending_evaluations[timeframe].extend(evaluations)
-            logger.info(f"收集到 {symbol} [{timeframe}] 的评估信息，当前待发送数量: {len(self.pending_evaluations[timeframe])}")
-            
-            # 触发发送评估信息（延迟一段时间，以便收集同一周期的多个币种）
-            # 如果该周期还没有发送任务在运行，则创建新任务
-            if timeframe not in self.evaluation_sending_tasks or not self.evaluation_sending_tasks[timeframe]:
-                self.evaluation_sending_tasks[timeframe] = True
-                logger.info(f"启动 {timeframe} 周期的评估信息发送任务")
-                self._track_task(self._send_evaluation_after_delay(timeframe))
-            else:
-                logger.info(f"{timeframe} 周期的评估信息发送任务已在运行中，等待合并发送")
-            
-        except Exception as e:
-            logger.error(f"收集评估信息时出错: {e}")
-    
-    async def _send_evaluation_after_delay(self, timeframe: str):
-        """延迟发送评估信息，以便收集同一周期的多个币种"""
-        try:
-            await asyncio.sleep(8)
-
-            if timeframe not in self.pending_evaluations or not self.pending_evaluations[timeframe]:
-                return
-
-            # 取出并清空（原子操作，避免竞态）
-            evaluations = self.pending_evaluations[timeframe].copy()
-            self.pending_evaluations[timeframe] = []
-
-            if self.on_evaluation_notification and evaluations:
-                logger.info(f"发送 {timeframe} 周期的评估信息，包含 {len(evaluations)} 条评估")
-                await self.on_evaluation_notification({
-                    'timeframe': timeframe,
-                    'evaluations': evaluations
-                })
-        except Exception as e:
-            logger.error(f"发送评估信息时出错: {e}")
-        finally:
-            # 重置标志前检查是否有残留（发送期间新进入的评估）
-            has_remaining = (
-                timeframe in self.pending_evaluations
-                and len(self.pending_evaluations[timeframe]) > 0
-            )
-            if has_remaining:
-                # 有残留，立即启动下一轮发送
-                logger.info(f"{timeframe} 发送期间有新评估进入，启动下一轮发送")
-                self._track_task(self._send_evaluation_after_delay(timeframe))
-            else:
-                self.evaluation_sending_tasks[timeframe] = False
+        return _TF_SECONDS_GET(timeframe, 900)
+
+    def _queue_evaluations(self, symbol: str, timeframe: str, evaluations: List[Dict]):
+        """把评估信息放入该周期的队列，由发送任务延迟合并发送；周期首次出现时启动其发送任务"""
+        queue = self._evaluation_queues.get(timeframe)
+        if queue is None:
+            queue = self._evaluation_queues[timeframe] = asyncio.Queue()
+            logger.info("启动 %s 周期的评估信息发送任务", timeframe)
+            self._track_task(self._evaluation_worker(timeframe, queue))
+        queue.put_nowait(evaluations)
+        logger.info("收集到 %s [%s] 的 %s 条评估信息", symbol, timeframe, len(evaluations))
+
+    async def _evaluation_worker(self, timeframe: str, queue: asyncio.Queue):
+        """某个周期的评估信息发送任务：收到第一条后等待一段时间，合并期间到达的所有评估一起发送"""
+        while self.running:
+            try:
+                evaluations = list(await queue.get())
+                await asyncio.sleep(self.EVALUATION_BATCH_DELAY)
+                while not queue.empty():
+                    evaluations.extend(queue.get_nowait())
+
+                if self.on_evaluation_notification:
+                    logger.info("发送 %s 周期的评估信息，包含 %s 条评估", timeframe, len(evaluations))
+                    await self.on_evaluation_notification({
+                        'timeframe': timeframe,
+                        'evaluations': evaluations
+                    })
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error("发送评估信息时出错: %s", e)
+
+    async def get_all_stop_loss_orders(self) -> List[StopLossOrder]:
+        """获取全部止损订单（按创建时间倒序），直接读内存副本，不查询数据库"""
+        if not self._orders_loaded:
+            return await self.database.get_all_stop_losses()
+        orders = sorted((order for group in self._order_groups.values() for order in group),
+                        key=lambda order: order.id)
+        # 与数据库查询一致：按创建时间倒序，同一时间内按 ID 顺序（稳定排序）
+        orders.sort(key=lambda order: order.created_at or '', reverse=True)
+        return orders
 
     async def add_stop_loss_order(self, symbol: str, side: str, stop_price: float,
                                   timeframe: str, quantity: Optional[float] = None) -> int:
         """添加止损订单"""
-        # 实时获取持仓以确保数据最新
-        positions = await self.binance_client.get_positions()
-        position_dict = {f"{pos['symbol']}_{pos['side']}": pos for pos in positions}
+        # 获取持仓以确保数据最新（刚拉取过则复用，并发调用共享同一次请求）
+        position_dict = await self._refresh_positions(self.POSITION_CACHE_MAX_AGE)
         
-        # 检查持仓是否存在（使用 symbol_side 组合）
-        position_key = f"{symbol}_{side}"
+        # 检查持仓是否存在（使用 (symbol, side) 组合）
+        position_key = (symbol, side)
         if position_key not in position_dict:
             raise ValueError(f"交易对 {symbol} 的 {side} 方向没有持仓")
         
@@ -566,10 +619,14 @@ class StopLossManager:
             raise ValueError(f"持仓方向不匹配: 持仓为 {position['side']}，止损为 {side}")
         
         # 添加到数据库
-        order_id = self.database.add_stop_loss(symbol, side, stop_price, timeframe, quantity)
+        async with self._order_write_lock:
+            order_id = await self.database.add_stop_loss(symbol, side, stop_price, timeframe, quantity)
+            order = await self.database.get_stop_loss_by_id(order_id)
+            if order:
+                self._cache_order(order)
 
         # 仅在该交易对周期尚无基准时初始化，避免覆盖已有订单正在使用的基准
-        kline_key = f"{symbol}_{timeframe}"
+        kline_key = (symbol, timeframe)
         if kline_key not in self.last_kline_close_time:
             try:
                 klines = await self.binance_client.get_kline_data(symbol, timeframe, limit=2)
@@ -579,13 +636,31 @@ class StopLossManager:
                         if current_time >= kline['close_time']:
                             self.last_kline_close_time[kline_key] = kline['close_time']
                     logger.info(
-                        f"初始化 {kline_key} 的K线基准时间: "
-                        f"{self.last_kline_close_time.get(kline_key, '未设置')}, "
-                        f"后续仅评估新收盘的K线"
+                        "初始化 %s [%s] 的K线基准时间: %s, 后续仅评估新收盘的K线",
+                        symbol, timeframe, self.last_kline_close_time.get(kline_key, '未设置')
                     )
             except Exception as e:
-                logger.warning(f"初始化 {kline_key} K线基准时间失败: {e}，首次评估可能包含历史K线")
+                logger.warning("初始化 %s [%s] K线基准时间失败: %s，首次评估可能包含历史K线", symbol, timeframe, e)
 
-        logger.info(f"添加止损订单成功: ID {order_id}, {symbol} {side} @ {stop_price} [{timeframe}]")
+        logger.info("添加止损订单成功: ID %s, %s %s @ %s [%s]", order_id, symbol, side, stop_price, timeframe)
 
         return order_id
+
+    async def update_stop_loss_order(self, order_id: int, stop_price: Optional[float] = None,
+                                     timeframe: Optional[str] = None, quantity: Optional[float] = None) -> bool:
+        """更新止损订单（数据库与内存同步更新）"""
+        async with self._order_write_lock:
+            order = await self.database.update_stop_loss(
+                order_id, stop_price=stop_price, timeframe=timeframe, quantity=quantity
+            )
+            if order:
+                # 周期可能变化（需要换组），直接用更新语句返回的最新记录替换
+                self._uncache_orders((order_id,))
+                self._cache_order(order)
+        return order is not None
+
+    async def delete_stop_loss_order(self, order_id: int) -> bool:
+        """删除止损订单（先移出内存，再删除数据库记录）"""
+        async with self._order_write_lock:
+            self._uncache_orders((order_id,))
+            return await self.database.delete_stop_loss(order_id)
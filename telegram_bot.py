@@ -5,9 +5,13 @@ Telegram Bot 模块
 import asyncio
 import functools
 import logging
+import random
+import re
 import time
-from typing import Dict, List, Optional
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand
+from telegram.error import BadRequest, Forbidden, RetryAfter
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -17,7 +21,7 @@ from telegram.ext import (
     ContextTypes,
     filters
 )
-from database import Database
+from database import Database, StopLossOrder
 from stop_loss_manager import StopLossManager
 
 logger = logging.getLogger(__name__)
@@ -27,6 +31,49 @@ logger = logging.getLogger(__name__)
  SELECTING_DELETE_ORDER, SELECTING_UPDATE_ORDER, SELECTING_UPDATE_FIELD,
  UPDATING_PRICE, UPDATING_TIMEFRAME) = range(8)
 
+# 止损价格输入格式：正的十进制数（拒绝 nan/inf/负数/科学计数法等 float() 能接受但不是合法价格的输入）
+_PRICE_RE = re.compile(r'^\s*\d{1,12}(?:\.\d{1,12})?\s*$')
+# 价格输入长度上限（合法价格最长 25 个字符，留出首尾空白余量），超长输入直接拒绝，不做正则匹配
+_PRICE_MAX_LENGTH = 32
+
+
+def _parse_price(text: str) -> Optional[float]:
+    """解析用户输入的价格，格式不合法或不大于 0 时返回 None"""
+    if not text or len(text) > _PRICE_MAX_LENGTH or not _PRICE_RE.match(text):
+        return None
+    price = float(text)
+    return price if price > 0 else None
+
+
+def _callback_args(data: str) -> List[str]:
+    """解析按钮回调数据，返回类型之后的参数
+
+    回调数据统一为 "类型|参数1|参数2" 格式（| 分隔，交易对名含下划线也不会解析错）
+    """
+    return data.split('|')[1:]
+
+
+class _AddStopLossSession:
+    """添加止损订单会话数据（保存在 context.user_data['session']）"""
+    __slots__ = ('symbol', 'side', 'timeframe')
+
+    def __init__(self, symbol: str, side: str):
+        self.symbol = symbol
+        self.side = side
+        self.timeframe: Optional[str] = None
+
+
+class _UpdateStopLossSession:
+    """更新止损订单会话数据（保存在 context.user_data['session']）"""
+    __slots__ = ('order_id', 'order', 'update_field', 'update_both', 'new_timeframe')
+
+    def __init__(self, order_id: int, order: StopLossOrder):
+        self.order_id = order_id
+        self.order = order
+        self.update_field: Optional[str] = None  # price / timeframe / both
+        self.update_both = False
+        self.new_timeframe: Optional[str] = None
+
 
 class TelegramBot:
     """Telegram Bot 管理类"""
@@ -35,12 +82,133 @@ class TelegramBot:
     NOTIFICATION_TOP_SEPARATOR = '═' * NOTIFICATION_SEPARATOR_LENGTH
     NOTIFICATION_BOTTOM_SEPARATOR = '─' * NOTIFICATION_SEPARATOR_LENGTH
 
-    def _build_notification_header(self, title: str) -> str:
-        """构建统一通知标题头"""
+    # HTTP 连接池大小：发件箱发送任务 1 个 + 命令回复/按钮回调（更新按顺序处理）1 个
+    # + 健康检查 1 个，再留 1 个余量，避免 pool_timeout
+    REQUEST_POOL_SIZE = 4
+    # getUpdates 长轮询等待时间（秒）
+    POLL_TIMEOUT = 30
+    # 单条消息重试的总时间预算（秒），超出后放弃，不再无限期占用发送任务
+    SEND_RETRY_BUDGET = 60
+    # 止损价格方向校验所用当前价的缓存时间（秒），用户改正输入后重新提交时复用
+    PRICE_CACHE_TTL = 5
+    # 发送失败率（指数加权平均）：每次失败 rate = 0.7*rate + 0.3，成功时 rate *= 0.3
+    # 连续约5次失败才超过阈值，偶发失败很快衰减，不会触发健康检查
+    SEND_FAILURE_DECAY = 0.7
+    SEND_FAILURE_THRESHOLD = 0.8
+    # 健康检查只在距上次成功发送超过该时间（秒）时介入
+    HEALTH_CHECK_MIN_SILENCE = 60
+    # 发件箱：通知消息排队后由单个发送任务合并发送（保证顺序，减少请求数）
+    OUTBOX_MAXSIZE = 1000
+    OUTBOX_DRAIN_TIMEOUT = 10  # 停止时等待发件箱发完的最长时间（秒）
+    OUTBOX_COALESCE_WINDOW = 0.5  # 收到一条消息后再等待的时间（秒），期间到达的消息合并发送
+    MESSAGE_MAX_LENGTH = 4000  # 单条消息长度上限（Telegram 限制 4096 字符）
+    MESSAGE_SEND_INTERVAL = 0.3  # 连续发送两条消息之间的间隔（秒），避免触发单聊天限流
+
+    # 帮助菜单按钮与欢迎/帮助文案固定不变，类定义时构建一次，各次命令共用
+    HELP_KEYBOARD = InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton("📊 查看持仓", callback_data="help_positions"),
+            InlineKeyboardButton("📋 委托订单", callback_data="help_orders"),
+        ],
+        [
+            InlineKeyboardButton("🛡 止损订单", callback_data="help_stoplosses"),
+            InlineKeyboardButton("💰 合约余额", callback_data="help_balance"),
+        ],
+        [
+            InlineKeyboardButton("➕ 添加止损", callback_data="help_addstoploss"),
+            InlineKeyboardButton("✏️ 更新止损", callback_data="help_updatestoploss"),
+        ],
+        [
+            InlineKeyboardButton("🗑 删除止损", callback_data="help_deletestoploss"),
+        ],
+    ])
+    # 各选择菜单末尾共用的取消按钮行
+    CANCEL_ROW = (InlineKeyboardButton("❌ 取消", callback_data="cancel"),)
+    # 添加止损时的 K 线周期选择键盘
+    TIMEFRAME_KEYBOARD = InlineKeyboardMarkup([
+        [InlineKeyboardButton("15 分钟", callback_data="timeframe|15m")],
+        [InlineKeyboardButton("1 小时", callback_data="timeframe|1h")],
+        [InlineKeyboardButton("4 小时", callback_data="timeframe|4h")],
+        CANCEL_ROW
+    ])
+    # 更新止损时的修改内容选择键盘
+    UPDATE_FIELD_KEYBOARD = InlineKeyboardMarkup([
+        [InlineKeyboardButton("💰 只修改价格", callback_data="field|price")],
+        [InlineKeyboardButton("⏰ 只修改周期", callback_data="field|timeframe")],
+        [InlineKeyboardButton("💰⏰ 修改价格和周期", callback_data="field|both")],
+        CANCEL_ROW
+    ])
+    # 更新止损时的新 K 线周期选择键盘
+    NEW_TIMEFRAME_KEYBOARD = InlineKeyboardMarkup([
+        [InlineKeyboardButton("15 分钟", callback_data="newtf|15m")],
+        [InlineKeyboardButton("1 小时", callback_data="newtf|1h")],
+        [InlineKeyboardButton("4 小时", callback_data="newtf|4h")],
+        CANCEL_ROW
+    ])
+    WELCOME_TEXT = (
+        "🤖 欢迎使用币安止损管理 Bot！\n\n"
+        "这个 Bot 可以帮助您管理基于 K 线确认的止损订单。\n\n"
+        "请选择您需要的功能："
+    )
+    HELP_TEXT = (
+        "📚 功能菜单\n\n"
+        "请点击下方按钮选择功能：\n\n"
+        "⚠️ 注意：\n"
+        "• Bot 的止损订单独立于币安委托\n"
+        "• 止损会在 K 线收盘后价格确认时触发\n"
+        "• 支持的时间周期：15m, 1h, 4h"
+    )
+
+    # Bot 命令菜单（固定内容，类定义时构建一次）
+    BOT_COMMANDS = (
+        BotCommand("start", "开始使用"),
+        BotCommand("help", "显示帮助信息"),
+        BotCommand("positions", "查看当前持仓"),
+        BotCommand("orders", "查看币安委托订单"),
+        BotCommand("balance", "查看合约账户余额"),
+        BotCommand("stoplosses", "查看所有止损订单"),
+        BotCommand("addstoploss", "添加止损订单"),
+        BotCommand("updatestoploss", "更新止损订单"),
+        BotCommand("deletestoploss", "删除止损订单"),
+        BotCommand("cancel", "取消当前操作"),
+    )
+
+    # 持仓方向的 (emoji, 描述)；非 LONG 的方向按做空显示
+    SHORT_SIDE_DISPLAY = ('🔴', '做空')
+    POSITION_SIDE_DISPLAY = {
+        'LONG': ('🟢', '做多'),
+        'SHORT': SHORT_SIDE_DISPLAY,
+    }
+    # 订单通知用的方向/类型/状态显示映射（固定内容，类定义时构建一次）
+    ORDER_SIDE_TEXT = {
+        'BUY': '买入/做多',
+        'SELL': '卖出/做空',
+    }
+    ORDER_TYPE_DISPLAY = {
+        'MARKET': ('⚡', '市价单'),
+        'LIMIT': ('📌', '限价单'),
+        'STOP': ('🛑', '止损单'),
+        'STOP_MARKET': ('🛑', '止损市价单'),
+        'TAKE_PROFIT': ('🎯', '止盈单'),
+        'TAKE_PROFIT_MARKET': ('🎯', '止盈市价单'),
+    }
+    ORDER_STATUS_DISPLAY = {
+        'NEW': ('🆕', '已创建'),
+        'FILLED': ('✅', '已完全成交'),
+        'CANCELED': ('❌', '已取消'),
+        'EXPIRED': ('⏰', '已过期'),
+        'REJECTED': ('🚫', '已拒绝'),
+        'PARTIALLY_FILLED': ('⏳', '部分成交'),
+    }
+
+    @staticmethod
+    @functools.lru_cache(maxsize=32)
+    def _build_notification_header(title: str) -> str:
+        """构建统一通知标题头（标题种类固定，按标题缓存）"""
         return (
-            f"{self.NOTIFICATION_TOP_SEPARATOR}\n"
+            f"{TelegramBot.NOTIFICATION_TOP_SEPARATOR}\n"
             f"{title}\n"
-            f"{self.NOTIFICATION_TOP_SEPARATOR}\n\n"
+            f"{TelegramBot.NOTIFICATION_TOP_SEPARATOR}\n\n"
         )
     
     def __init__(self, token: str, chat_id: str, database: Database, 
@@ -50,61 +218,54 @@ class TelegramBot:
         self.database = database
         self.stop_loss_manager = stop_loss_manager
         self.application = None
+        # Bot.send_message 绑定方法（start 时获取一次；重新初始化连接复用同一个 Bot 对象，无需更新）
+        self._bot_send = None
         
         # 授权的 chat_id 列表（支持多个）
-        self.allowed_chat_ids = {str(chat_id)}
-
-        # 临时存储用户输入（带 TTL 自动清理）
-        # 格式: {user_id: {'_created_at': timestamp, ...其他数据}}
-        self.user_data_cache = {}
-        self.user_data_cache_ttl = 600  # 10分钟过期
-        self.cache_cleanup_task = None
+        # 按整数保存，与 update.effective_chat.id 直接比较，无需每次转换为字符串
+        self.allowed_chat_ids = frozenset({int(chat_id)})
 
-        # 消息发送失败计数器和健康检查
-        self.failed_send_count = 0
+        # 消息发送失败率和健康检查
+        self.send_failure_rate = 0.0
         self.last_successful_send = time.time()
         self.health_check_interval = 300  # 5分钟检查一次
         self.health_check_task = None
 
+        # 发件箱队列及其发送任务（start 后启用；未启用时 send_message 直接发送）
+        self._outbox: asyncio.Queue = asyncio.Queue(maxsize=self.OUTBOX_MAXSIZE)
+        self.outbox_task = None
+
+        # 当前价缓存: {symbol: (price, 获取时间（单调时钟）)}
+        self._price_cache: Dict[str, Tuple[float, float]] = {}
+
+        # help_ 菜单中查询类按钮的处理函数（直接复用命令处理函数，只构建一次）
+        self._help_query_handlers = {
+            "positions": self.cmd_positions,
+            "orders": self.cmd_orders,
+            "stoplosses": self.cmd_stop_losses,
+            "balance": self.cmd_balance,
+        }
+
     def _is_authorized(self, update: Update) -> bool:
         """检查用户是否有权限操作 Bot"""
-        chat_id = str(update.effective_chat.id) if update.effective_chat else None
-        return chat_id in self.allowed_chat_ids
+        chat = update.effective_chat
+        return chat is not None and chat.id in self.allowed_chat_ids
 
     async def _unauthorized_handler(self, update: Update):
         """处理未授权的访问"""
         user = update.effective_user
         chat_id = update.effective_chat.id if update.effective_chat else 'unknown'
-        logger.warning(f"未授权访问: user_id={user.id if user else 'unknown'}, chat_id={chat_id}")
-
-    async def _cache_cleanup_loop(self):
-        """定期清理过期的 user_data_cache 条目"""
-        while True:
-            try:
-                await asyncio.sleep(60)  # 每60秒检查一次
-                now = time.time()
-                expired_keys = [
-                    uid for uid, data in self.user_data_cache.items()
-                    if now - data.get('_created_at', 0) > self.user_data_cache_ttl
-                ]
-                for uid in expired_keys:
-                    del self.user_data_cache[uid]
-                if expired_keys:
-                    logger.info(f"清理了 {len(expired_keys)} 个过期的会话缓存")
-            except asyncio.CancelledError:
-                break
-            except Exception as e:
-                logger.error(f"缓存清理任务出错: {e}")
+        logger.warning("未授权访问: user_id=%s, chat_id=%s", user.id if user else 'unknown', chat_id)
 
     async def start(self):
         """启动 Telegram Bot"""
         # 配置连接参数，增强网络容错性
-        from telegram.ext import Defaults
         from telegram.request import HTTPXRequest
         
         # 创建自定义请求对象，设置更长的超时和重试
+        # getUpdates 长轮询由 PTB 使用单独的请求对象，不占用这里的连接池
         request = HTTPXRequest(
-            connection_pool_size=8,
+            connection_pool_size=self.REQUEST_POOL_SIZE,
             connect_timeout=30.0,
             read_timeout=30.0,
             write_timeout=30.0,
@@ -117,6 +278,7 @@ class TelegramBot:
             .request(request)
             .build()
         )
+        self._bot_send = self.application.bot.send_message
         
         # 添加命令处理器
         self.application.add_handler(CommandHandler("start", self.cmd_start))
@@ -189,36 +351,29 @@ class TelegramBot:
         # 设置 Bot 命令菜单
         await self.set_bot_commands()
         
-        await self.application.updater.start_polling()
+        # 长轮询：无更新时由 Telegram 挂起请求最多 POLL_TIMEOUT 秒（PTB 会把它加到 getUpdates 的读超时上）；
+        # 只订阅本 Bot 处理的消息和按钮回调；停机期间积压的旧命令/按钮不再执行
+        await self.application.updater.start_polling(
+            timeout=self.POLL_TIMEOUT,
+            allowed_updates=[Update.MESSAGE, Update.CALLBACK_QUERY],
+            drop_pending_updates=True,
+        )
         
         # 启动健康检查任务
         self.health_check_task = asyncio.create_task(self._health_check_loop())
 
-        # 启动缓存清理任务
-        self.cache_cleanup_task = asyncio.create_task(self._cache_cleanup_loop())
+        # 启动发件箱发送任务
+        self.outbox_task = asyncio.create_task(self._outbox_worker())
 
-        logger.info("Telegram Bot 已启动（含健康检查和缓存清理）")
+        logger.info("Telegram Bot 已启动（含健康检查）")
 
     async def set_bot_commands(self):
         """设置 Bot 命令菜单"""
-        commands = [
-            BotCommand("start", "开始使用"),
-            BotCommand("help", "显示帮助信息"),
-            BotCommand("positions", "查看当前持仓"),
-            BotCommand("orders", "查看币安委托订单"),
-            BotCommand("balance", "查看合约账户余额"),
-            BotCommand("stoplosses", "查看所有止损订单"),
-            BotCommand("addstoploss", "添加止损订单"),
-            BotCommand("updatestoploss", "更新止损订单"),
-            BotCommand("deletestoploss", "删除止损订单"),
-            BotCommand("cancel", "取消当前操作"),
-        ]
-        
         try:
-            await self.application.bot.set_my_commands(commands)
+            await self.application.bot.set_my_commands(self.BOT_COMMANDS)
             logger.info("Bot 命令菜单已设置")
         except Exception as e:
-            logger.error(f"设置 Bot 命令菜单失败: {e}")
+            logger.error("设置 Bot 命令菜单失败: %s", e)
 
     async def _reinitialize_connection(self):
         """重新初始化 Telegram Bot 连接
@@ -234,17 +389,17 @@ class TelegramBot:
                 try:
                     await self.application.bot.close()
                 except Exception as e:
-                    logger.warning(f"关闭旧 Bot 连接时出错: {e}")
+                    logger.warning("关闭旧 Bot 连接时出错: %s", e)
 
                 try:
                     await self.application.bot.initialize()
                 except Exception as e:
-                    logger.warning(f"重新初始化 Bot 时出错: {e}")
+                    logger.warning("重新初始化 Bot 时出错: %s", e)
 
                 logger.info("Telegram Bot 连接重新初始化成功")
                 
         except Exception as e:
-            logger.error(f"重新初始化 Telegram Bot 连接失败: {e}", exc_info=True)
+            logger.error("重新初始化 Telegram Bot 连接失败: %s", e, exc_info=True)
             raise
 
     async def _health_check_loop(self):
@@ -259,11 +414,12 @@ class TelegramBot:
                 # 检查上次成功发送消息的时间
                 time_since_last_success = time.time() - self.last_successful_send
                 
-                # 如果连续失败次数过多，或者很久没有成功发送过消息
-                if self.failed_send_count >= 5:
+                # 发送持续失败（失败率高且一段时间内没有成功发送过消息）
+                if self.send_failure_rate > self.SEND_FAILURE_THRESHOLD \
+                        and time_since_last_success > self.HEALTH_CHECK_MIN_SILENCE:
                     logger.warning(
-                        f"检测到连续 {self.failed_send_count} 次发送失败，"
-                        f"执行主动健康检查..."
+                        "检测到发送持续失败（失败率 %.2f，%.0f 秒未成功发送），执行主动健康检查...",
+                        self.send_failure_rate, time_since_last_success
                     )
                     try:
                         # 尝试发送测试消息
@@ -276,10 +432,10 @@ class TelegramBot:
                             connect_timeout=10
                         )
                         logger.info("健康检查通过，连接正常")
-                        self.failed_send_count = 0
+                        self.send_failure_rate = 0.0
                         self.last_successful_send = time.time()
                     except Exception as e:
-                        logger.error(f"健康检查失败: {e}")
+                        logger.error("健康检查失败: %s", e)
                         # 尝试重新初始化连接
                         await self._reinitialize_connection()
                         
@@ -287,23 +443,28 @@ class TelegramBot:
                 logger.info("健康检查任务已取消")
                 break
             except Exception as e:
-                logger.error(f"健康检查任务错误: {e}", exc_info=True)
+                logger.error("健康检查任务错误: %s", e, exc_info=True)
 
     async def stop(self):
         """停止 Telegram Bot"""
-        # 取消健康检查任务
-        if self.health_check_task:
-            self.health_check_task.cancel()
+        # 先把发件箱中已排队的消息发完（最多等待 OUTBOX_DRAIN_TIMEOUT 秒），再停止发送任务
+        if self.outbox_task:
             try:
-                await self.health_check_task
+                await asyncio.wait_for(self._outbox.join(), timeout=self.OUTBOX_DRAIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning("发件箱仍有 %s 条消息未发送，放弃发送", self._outbox.qsize())
+            self.outbox_task.cancel()
+            try:
+                await self.outbox_task
             except asyncio.CancelledError:
                 pass
+            self.outbox_task = None
 
-        # 取消缓存清理任务
-        if self.cache_cleanup_task:
-            self.cache_cleanup_task.cancel()
+        # 取消健康检查任务
+        if self.health_check_task:
+            self.health_check_task.cancel()
             try:
-                await self.cache_cleanup_task
+                await self.health_check_task
             except asyncio.CancelledError:
                 pass
 
@@ -316,46 +477,109 @@ class TelegramBot:
     async def send_message(self, text: str, retry_count: int = 10):
         """发送消息到指定的 chat，带增强重试机制和自动恢复
 
+        发件箱启用后消息只入队即返回，由发送任务按顺序合并发送
+
         Args:
             text: 要发送的消息文本
             retry_count: 重试次数（默认10次）
         """
-        # 自动分页：Telegram 消息限制 4096 字符
-        max_len = 4000
+        if self.outbox_task is None:
+            await self._deliver_message(text, retry_count)
+            return
+        try:
+            # 不阻塞调用方（如止损执行回调）；队列满说明 Telegram 长时间不可用
+            self._outbox.put_nowait((text, retry_count))
+        except asyncio.QueueFull:
+            logger.error("发件箱已满，丢弃消息: %s...", text[:100])
+
+    async def _outbox_worker(self):
+        """发件箱发送任务：取出排队中的消息，合并为不超过单条长度上限的消息后发送"""
+        outbox = self._outbox
+        carry = None  # 上一批放不下、留给下一批打头的消息（已取出，计入下一批的 task_done）
+        while True:
+            taken = 0  # 本批已从队列取出的消息数，无论成功与否都要逐一 task_done，stop() 的 join 才不会空等
+            try:
+                if carry is None:
+                    text, retry_count = await outbox.get()
+                    taken = 1
+                    # 突发事件（如多个订单同时成交）通常在极短时间内先后到达，稍等片刻一并合并
+                    await asyncio.sleep(self.OUTBOX_COALESCE_WINDOW)
+                else:
+                    text, retry_count = carry
+                    carry = None
+                    taken = 1
+                parts = [text]
+                length = len(text)
+                while not outbox.empty():
+                    item = outbox.get_nowait()
+                    if length + 2 + len(item[0]) > self.MESSAGE_MAX_LENGTH:
+                        carry = item
+                        break
+                    taken += 1
+                    parts.append(item[0])
+                    length += 2 + len(item[0])
+                    retry_count = max(retry_count, item[1])
+                await self._deliver_message("\n\n".join(parts), retry_count)
+                await asyncio.sleep(self.MESSAGE_SEND_INTERVAL)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error("发件箱发送任务出错: %s", e)
+            finally:
+                for _ in range(taken):
+                    outbox.task_done()
+        # 停止时仍留在手中的 carry 已不会再发送，同样计入完成
+        if carry is not None:
+            outbox.task_done()
+
+    async def _deliver_message(self, text: str, retry_count: int = 10):
+        """立即发送一条消息，超长时自动分页"""
+        # 同一条消息的各分页必须按顺序送达，逐页发送
+        max_len = self.MESSAGE_MAX_LENGTH
         if len(text) > max_len:
             chunks = self._split_message(text, max_len)
             for i, chunk in enumerate(chunks):
                 await self._send_single_message(chunk, retry_count)
                 if i < len(chunks) - 1:
-                    await asyncio.sleep(0.3)
+                    await asyncio.sleep(self.MESSAGE_SEND_INTERVAL)
             return
 
         await self._send_single_message(text, retry_count)
 
     @staticmethod
     def _split_message(text: str, max_len: int) -> list:
-        """按换行符智能拆分长消息"""
+        """按换行符智能拆分长消息（用下标向前推进，不反复复制剩余文本）"""
         chunks = []
-        while len(text) > max_len:
-            split_pos = text.rfind('\n', 0, max_len)
+        start, end = 0, len(text)
+        while end - start > max_len:
+            split_pos = text.rfind('\n', start, start + max_len)
             if split_pos == -1:
-                split_pos = max_len
-            chunks.append(text[:split_pos])
-            text = text[split_pos:].lstrip('\n')
-        if text:
-            chunks.append(text)
+                split_pos = start + max_len
+            chunks.append(text[start:split_pos])
+            # 跳过分割点处的换行符
+            start = split_pos
+            while start < end and text[start] == '\n':
+                start += 1
+        if start < end:
+            chunks.append(text[start:])
         return chunks
 
     async def _send_single_message(self, text: str, retry_count: int = 10):
-        """发送单条消息（带重试）"""
+        """发送单条消息（带重试）
+
+        请求错误/无权限属于永久错误，不重试；限流按服务端要求的时间等待；
+        其余错误（网络、超时等）按带抖动的指数退避重试，总耗时不超过 SEND_RETRY_BUDGET
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.SEND_RETRY_BUDGET
         for attempt in range(retry_count):
             try:
-                # 检查 application 是否存在
-                if self.application is None:
+                # 检查 application 是否已初始化
+                if self._bot_send is None:
                     logger.error("Telegram application 未初始化")
                     return
                 
-                await self.application.bot.send_message(
+                await self._bot_send(
                     chat_id=self.chat_id, 
                     text=text,
                     read_timeout=30,  # 增加读超时
@@ -363,95 +587,81 @@ class TelegramBot:
                     connect_timeout=30  # 增加连接超时
                 )
                 
-                # 发送成功，更新计数器和时间戳
-                self.failed_send_count = 0
+                # 发送成功，衰减失败率并更新时间戳
+                self.send_failure_rate *= 1 - self.SEND_FAILURE_DECAY
                 self.last_successful_send = time.time()
-                logger.debug(f"消息发送成功: {text[:50]}...")
+                logger.debug("消息发送成功: %.50s...", text)
+                return
+
+            except (BadRequest, Forbidden) as e:
+                # 消息内容非法、chat_id 无效或 Bot 被拉黑，重试也不会成功（不计入发送失败率）
+                logger.error(
+                    "发送消息失败（不可重试）: %s - %s\n消息内容: %s...", type(e).__name__, e, text[:100]
+                )
                 return
+
+            except RetryAfter as e:
+                logger.warning("发送消息触发限流，%s 秒后重试 (尝试 %s/%s)", e.retry_after, attempt + 1, retry_count)
+                if loop.time() + e.retry_after > deadline:
+                    logger.error("限流等待超出重试时间预算，放弃发送\n消息内容: %s...", text[:100])
+                    return
+                await asyncio.sleep(e.retry_after)
                 
             except Exception as e:
-                self.failed_send_count += 1
+                self.send_failure_rate = self.send_failure_rate * self.SEND_FAILURE_DECAY + (1 - self.SEND_FAILURE_DECAY)
                 error_type = type(e).__name__
-                logger.error(f"发送消息失败 (尝试 {attempt + 1}/{retry_count}): {error_type} - {e}")
+                logger.error("发送消息失败 (尝试 %s/%s): %s - %s", attempt + 1, retry_count, error_type, e)
                 
-                if attempt < retry_count - 1:
-                    # 指数退避，但最多等待30秒
-                    wait_time = min(2 ** attempt, 30)
-                    logger.info(f"等待 {wait_time} 秒后重试...")
+                # 指数退避（最多30秒）加随机抖动，超出时间预算则不再重试
+                wait_time = min(2 ** attempt, 30) + random.uniform(0, 1)
+                if attempt < retry_count - 1 and loop.time() + wait_time <= deadline:
+                    logger.info("等待 %.1f 秒后重试...", wait_time)
                     await asyncio.sleep(wait_time)
-                    
-                    # 如果连续失败3次，尝试重新初始化连接
-                    if (attempt + 1) % 3 == 0:
-                        logger.warning(f"连续失败 {attempt + 1} 次，尝试重新初始化 Telegram 连接...")
-                        try:
-                            await self._reinitialize_connection()
-                        except Exception as reinit_error:
-                            logger.error(f"重新初始化连接失败: {reinit_error}")
+                    # 连接重建由健康检查统一负责，发送路径只做退避重试
                 else:
                     logger.error(
-                        f"发送消息最终失败，已重试 {retry_count} 次\n"
-                        f"消息内容: {text[:100]}...\n"
-                        f"连续失败次数: {self.failed_send_count}"
+                        "发送消息最终失败，已尝试 %s 次\n消息内容: %s...\n发送失败率: %.2f",
+                        attempt + 1, text[:100], self.send_failure_rate
                     )
+                    return
+
+    async def _current_price(self, symbol: str) -> Optional[float]:
+        """获取交易对当前价（最新 1m K线收盘价），PRICE_CACHE_TTL 秒内复用上次结果"""
+        cached = self._price_cache.get(symbol)
+        now = time.monotonic()
+        if cached and now - cached[1] < self.PRICE_CACHE_TTL:
+            return cached[0]
+        klines = await self.stop_loss_manager.binance_client.get_kline_data(symbol, '1m', limit=1)
+        if not klines:
+            return None
+        price = klines[0]['close']
+        self._price_cache[symbol] = (price, now)
+        return price
 
     # ==================== 命令处理器 ====================
     
     async def _reply(self, update: Update, text: str, reply_markup=None):
         """统一回复方法：支持命令消息和按钮回调两种来源"""
-        if update.message:
-            await update.message.reply_text(text, reply_markup=reply_markup)
-        elif update.callback_query:
-            await update.callback_query.message.reply_text(text, reply_markup=reply_markup)
+        # effective_message 对命令消息和按钮回调都指向所在消息，由 Update 解析一次后缓存
+        message = update.effective_message
+        if message:
+            await message.reply_text(text, reply_markup=reply_markup)
         else:
             await self.send_message(text)
 
-    def _build_help_keyboard(self) -> InlineKeyboardMarkup:
-        """构建帮助菜单的 InlineKeyboard 按钮"""
-        keyboard = [
-            [
-                InlineKeyboardButton("📊 查看持仓", callback_data="help_positions"),
-                InlineKeyboardButton("📋 委托订单", callback_data="help_orders"),
-            ],
-            [
-                InlineKeyboardButton("🛡 止损订单", callback_data="help_stoplosses"),
-                InlineKeyboardButton("💰 合约余额", callback_data="help_balance"),
-            ],
-            [
-                InlineKeyboardButton("➕ 添加止损", callback_data="help_addstoploss"),
-                InlineKeyboardButton("✏️ 更新止损", callback_data="help_updatestoploss"),
-            ],
-            [
-                InlineKeyboardButton("🗑 删除止损", callback_data="help_deletestoploss"),
-            ],
-        ]
-        return InlineKeyboardMarkup(keyboard)
-
     async def cmd_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """处理 /start 命令"""
         if not self._is_authorized(update):
             await self._unauthorized_handler(update)
             return
-        welcome_text = (
-            "🤖 欢迎使用币安止损管理 Bot！\n\n"
-            "这个 Bot 可以帮助您管理基于 K 线确认的止损订单。\n\n"
-            "请选择您需要的功能："
-        )
-        await update.message.reply_text(welcome_text, reply_markup=self._build_help_keyboard())
+        await update.message.reply_text(self.WELCOME_TEXT, reply_markup=self.HELP_KEYBOARD)
 
     async def cmd_help(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """处理 /help 命令"""
         if not self._is_authorized(update):
             await self._unauthorized_handler(update)
             return
-        help_text = (
-            "📚 功能菜单\n\n"
-            "请点击下方按钮选择功能：\n\n"
-            "⚠️ 注意：\n"
-            "• Bot 的止损订单独立于币安委托\n"
-            "• 止损会在 K 线收盘后价格确认时触发\n"
-            "• 支持的时间周期：15m, 1h, 4h"
-        )
-        await update.message.reply_text(help_text, reply_markup=self._build_help_keyboard())
+        await update.message.reply_text(self.HELP_TEXT, reply_markup=self.HELP_KEYBOARD)
 
     async def cmd_positions(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """处理 /positions 命令 - 查看当前持仓"""
@@ -465,9 +675,9 @@ class TelegramBot:
                 await self._reply(update, "📭 当前没有持仓")
                 return
             
-            text = "📊 当前持仓：\n\n"
+            parts = ["📊 当前持仓：\n\n"]
             for pos in positions:
-                text += (
+                parts.append(
                     f"🔸 {pos['symbol']}\n"
                     f"  方向: {pos['side']}\n"
                     f"  数量: {pos['position_amt']}\n"
@@ -477,7 +687,7 @@ class TelegramBot:
                     f"  强平价: {pos['liquidation_price']}\n\n"
                 )
             
-            await self._reply(update, text)
+            await self._reply(update, "".join(parts))
 
         except Exception as e:
             await self._reply(update, f"❌ 获取持仓失败: {e}")
@@ -500,15 +710,15 @@ class TelegramBot:
         if not balances:
             return "📭 合约账户暂无余额"
 
-        text = "💰 合约账户余额：\n\n"
+        parts = ["💰 合约账户余额：\n\n"]
         for b in balances:
-            text += (
+            parts.append(
                 f"🔸 {b['asset']}\n"
                 f"  余额: {b['balance']:.4f}\n"
                 f"  可用: {b['available']:.4f}\n"
                 f"  未实现盈亏: {b['unrealized_pnl']:.4f}\n\n"
             )
-        return text
+        return "".join(parts)
 
     async def cmd_orders(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """处理 /orders 命令 - 查看币安委托订单"""
@@ -522,9 +732,9 @@ class TelegramBot:
                 await self._reply(update, "📭 当前没有币安委托订单")
                 return
             
-            text = "📋 币安委托订单：\n\n"
+            parts = ["📋 币安委托订单：\n\n"]
             for order in orders:
-                text += (
+                parts.append(
                     f"🔸 {order['symbol']}\n"
                     f"  订单ID: {order['order_id']}\n"
                     f"  方向: {order['side']}\n"
@@ -534,22 +744,20 @@ class TelegramBot:
                 
                 # 添加触发价格（如果有）
                 if order['stop_price'] > 0:
-                    text += f"  触发价格: {order['stop_price']}\n"
+                    parts.append(f"  触发价格: {order['stop_price']}\n")
                 
-                text += (
+                parts.append(
                     f"  数量: {order['quantity']}\n"
                     f"  状态: {order['status']}\n"
                 )
                 
                 # 添加只减仓标识
                 if order['reduce_only']:
-                    text += "  只减仓: 是\n"
+                    parts.append("  只减仓: 是\n\n")
                 else:
-                    text += "  只减仓: 否\n"
-                
-                text += "\n"
+                    parts.append("  只减仓: 否\n\n")
             
-            await self._reply(update, text)
+            await self._reply(update, "".join(parts))
 
         except Exception as e:
             await self._reply(update, f"❌ 获取订单失败: {e}")
@@ -559,15 +767,15 @@ class TelegramBot:
         if not self._is_authorized(update):
             await self._unauthorized_handler(update)
             return
-        stop_losses = self.database.get_all_stop_losses()
+        stop_losses = await self.stop_loss_manager.get_all_stop_loss_orders()
         
         if not stop_losses:
             await self._reply(update, "📭 当前没有止损订单")
             return
 
-        text = "🛡️ Bot 止损订单：\n\n"
+        parts = ["🛡️ Bot 止损订单：\n\n"]
         for order in stop_losses:
-            text += (
+            parts.append(
                 f"🔸 ID: {order.id}\n"
                 f"  交易对: {order.symbol}\n"
                 f"  方向: {order.side}\n"
@@ -577,43 +785,42 @@ class TelegramBot:
                 f"  创建时间: {order.created_at}\n\n"
             )
         
-        await self._reply(update, text)
+        await self._reply(update, "".join(parts))
 
     async def cmd_add_stop_loss(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """处理 /addstoploss 命令或菜单按钮 - 开始添加止损订单流程"""
-        # 兼容按钮回调来源
-        if update.callback_query:
-            await update.callback_query.answer()
         if not self._is_authorized(update):
             await self._unauthorized_handler(update)
             return ConversationHandler.END
+        # 兼容按钮回调来源
+        if update.callback_query:
+            await update.callback_query.answer()
         try:
             user = update.effective_user
-            logger.info(f"用户 {user.id} 执行添加止损操作")
+            logger.info("用户 %s 执行添加止损操作", user.id)
             # 获取当前持仓
             positions = await self.stop_loss_manager.binance_client.get_positions()
-            logger.info(f"获取到 {len(positions)} 个持仓")
+            logger.info("获取到 %s 个持仓", len(positions))
 
             if not positions:
                 await self._reply(update, "📭 当前没有持仓，无法添加止损订单")
                 return ConversationHandler.END
 
             # 创建按钮
-            keyboard = []
-            for pos in positions:
-                button_text = f"{pos['symbol']} ({pos['side']})"
-                keyboard.append([InlineKeyboardButton(button_text, callback_data=f"symbol|{pos['symbol']}|{pos['side']}")])
-
-            keyboard.append([InlineKeyboardButton("❌ 取消", callback_data="cancel")])
+            keyboard = [
+                [InlineKeyboardButton(f"{pos['symbol']} ({pos['side']})", callback_data=f"symbol|{pos['symbol']}|{pos['side']}")]
+                for pos in positions
+            ]
+            keyboard.append(self.CANCEL_ROW)
             reply_markup = InlineKeyboardMarkup(keyboard)
 
             await self._reply(update, "请选择要设置止损的持仓：", reply_markup=reply_markup)
 
-            logger.info(f"已发送持仓选择消息给用户 {user.id}")
+            logger.info("已发送持仓选择消息给用户 %s", user.id)
             return SELECTING_SYMBOL
             
         except Exception as e:
-            logger.error(f"执行添加止损操作时出错: {e}", exc_info=True)
+            logger.error("执行添加止损操作时出错: %s", e, exc_info=True)
             await self._reply(update, f"❌ 获取持仓失败: {e}")
             return ConversationHandler.END
 
@@ -623,46 +830,37 @@ class TelegramBot:
             query = update.callback_query
             await query.answer()
             
-            logger.info(f"用户选择回调: {query.data}")
+            logger.info("用户选择回调: %s", query.data)
             
             if query.data == "cancel":
                 await query.edit_message_text("❌ 操作已取消")
                 return ConversationHandler.END
             
-            # 解析选择的交易对和方向（使用 | 分隔，避免 symbol 含下划线时解析错误）
-            parts = query.data.split("|")
-            if len(parts) < 3:
-                logger.error(f"回调数据格式错误: {query.data}")
+            # 解析选择的交易对和方向
+            args = _callback_args(query.data)
+            if len(args) < 2:
+                logger.error("回调数据格式错误: %s", query.data)
                 await query.edit_message_text("❌ 数据格式错误，请重新开始")
                 return ConversationHandler.END
 
-            symbol = parts[1]
-            side = parts[2]
-            logger.info(f"选择交易对: {symbol}, 方向: {side}")
+            symbol, side = args[0], args[1]
+            logger.info("选择交易对: %s, 方向: %s", symbol, side)
             
             # 保存到用户数据
             user_id = query.from_user.id
-            self.user_data_cache[user_id] = {'symbol': symbol, 'side': side, '_created_at': time.time()}
+            context.user_data['session'] = _AddStopLossSession(symbol, side)
             
             # 显示时间周期选择
-            keyboard = [
-                [InlineKeyboardButton("15 分钟", callback_data="timeframe_15m")],
-                [InlineKeyboardButton("1 小时", callback_data="timeframe_1h")],
-                [InlineKeyboardButton("4 小时", callback_data="timeframe_4h")],
-                [InlineKeyboardButton("❌ 取消", callback_data="cancel")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
             await query.edit_message_text(
                 f"已选择: {symbol} ({side})\n\n请选择 K 线周期：",
-                reply_markup=reply_markup
+                reply_markup=self.TIMEFRAME_KEYBOARD
             )
             
-            logger.info(f"已发送时间周期选择消息给用户 {user_id}")
+            logger.info("已发送时间周期选择消息给用户 %s", user_id)
             return SELECTING_TIMEFRAME
             
         except Exception as e:
-            logger.error(f"选择交易对时出错: {e}", exc_info=True)
+            logger.error("选择交易对时出错: %s", e, exc_info=True)
             if update.callback_query:
                 await update.callback_query.answer()
                 await update.callback_query.edit_message_text(f"❌ 处理失败: {e}")
@@ -674,45 +872,44 @@ class TelegramBot:
             query = update.callback_query
             await query.answer()
             
-            logger.info(f"用户选择时间周期回调: {query.data}")
+            logger.info("用户选择时间周期回调: %s", query.data)
             
             if query.data == "cancel":
                 await query.edit_message_text("❌ 操作已取消")
                 return ConversationHandler.END
             
             # 解析时间周期
-            parts = query.data.split("_")
-            if len(parts) < 2:
-                logger.error(f"时间周期回调数据格式错误: {query.data}")
+            args = _callback_args(query.data)
+            if not args:
+                logger.error("时间周期回调数据格式错误: %s", query.data)
                 await query.edit_message_text("❌ 数据格式错误，请重新开始")
                 return ConversationHandler.END
                 
-            timeframe = parts[1]
+            timeframe = args[0]
             
             # 保存到用户数据
             user_id = query.from_user.id
-            if user_id not in self.user_data_cache:
-                logger.error(f"用户 {user_id} 的会话数据不存在")
+            user_data = context.user_data.get('session')
+            if user_data is None:
+                logger.error("用户 %s 的会话数据不存在", user_id)
                 await query.edit_message_text("❌ 会话已过期，请重新开始")
                 return ConversationHandler.END
                 
-            self.user_data_cache[user_id]['timeframe'] = timeframe
-            
-            user_data = self.user_data_cache[user_id]
+            user_data.timeframe = timeframe
             
             await query.edit_message_text(
                 f"已选择:\n"
-                f"  交易对: {user_data['symbol']}\n"
-                f"  方向: {user_data['side']}\n"
+                f"  交易对: {user_data.symbol}\n"
+                f"  方向: {user_data.side}\n"
                 f"  周期: {timeframe}\n\n"
                 f"请输入止损价格："
             )
             
-            logger.info(f"已发送价格输入提示给用户 {user_id}")
+            logger.info("已发送价格输入提示给用户 %s", user_id)
             return ENTERING_PRICE
             
         except Exception as e:
-            logger.error(f"选择时间周期时出错: {e}", exc_info=True)
+            logger.error("选择时间周期时出错: %s", e, exc_info=True)
             if update.callback_query:
                 await update.callback_query.answer()
                 await update.callback_query.edit_message_text(f"❌ 处理失败: {e}")
@@ -722,31 +919,29 @@ class TelegramBot:
         """输入止损价格"""
         try:
             user_id = update.message.from_user.id
-            logger.info(f"用户 {user_id} 输入价格: {update.message.text}")
+            logger.info("用户 %s 输入价格: %s", user_id, update.message.text)
             
-            if user_id not in self.user_data_cache:
-                logger.warning(f"用户 {user_id} 的会话数据不存在")
+            user_data = context.user_data.get('session')
+            if user_data is None:
+                logger.warning("用户 %s 的会话数据不存在", user_id)
                 await update.message.reply_text("❌ 会话已过期，请重新开始")
                 return ConversationHandler.END
             
             # 解析价格
-            try:
-                stop_price = float(update.message.text)
-            except ValueError:
-                logger.warning(f"用户 {user_id} 输入的价格格式错误: {update.message.text}")
-                await update.message.reply_text("❌ 价格格式错误，请输入有效数字")
+            stop_price = _parse_price(update.message.text)
+            if stop_price is None:
+                logger.warning("用户 %s 输入的价格格式错误: %s", user_id, update.message.text)
+                await update.message.reply_text("❌ 价格格式错误，请输入大于 0 的数字")
                 return ENTERING_PRICE
             
-            user_data = self.user_data_cache[user_id]
-            symbol = user_data['symbol']
-            side = user_data['side']
-            timeframe = user_data['timeframe']
+            symbol = user_data.symbol
+            side = user_data.side
+            timeframe = user_data.timeframe
 
             # 止损价格方向合理性校验
             try:
-                klines = await self.stop_loss_manager.binance_client.get_kline_data(symbol, '1m', limit=1)
-                if klines:
-                    current_price = klines[0]['close']
+                current_price = await self._current_price(symbol)
+                if current_price is not None:
                     if side == 'LONG' and stop_price >= current_price:
                         await update.message.reply_text(
                             f"⚠️ 多头止损价应低于当前价格\n"
@@ -764,9 +959,9 @@ class TelegramBot:
                         )
                         return ENTERING_PRICE
             except Exception as e:
-                logger.warning(f"获取当前价格校验失败（不阻塞创建）: {e}")
+                logger.warning("获取当前价格校验失败（不阻塞创建）: %s", e)
 
-            logger.info(f"准备创建止损订单: {symbol} {side} @ {stop_price} [{timeframe}]")
+            logger.info("准备创建止损订单: %s %s @ %s [%s]", symbol, side, stop_price, timeframe)
 
             # 添加止损订单
             order_id = await self.stop_loss_manager.add_stop_loss_order(
@@ -776,7 +971,7 @@ class TelegramBot:
                 timeframe=timeframe
             )
             
-            logger.info(f"止损订单创建成功: ID {order_id}")
+            logger.info("止损订单创建成功: ID %s", order_id)
             
             await update.message.reply_text(
                 f"✅ 止损订单已创建！\n\n"
@@ -789,38 +984,38 @@ class TelegramBot:
             )
             
             # 清理缓存
-            del self.user_data_cache[user_id]
+            context.user_data.pop('session', None)
             
             return ConversationHandler.END
             
         except Exception as e:
-            logger.error(f"创建止损订单时出错: {e}", exc_info=True)
-            user_id = update.message.from_user.id
+            logger.error("创建止损订单时出错: %s", e, exc_info=True)
             await update.message.reply_text(f"❌ 创建止损订单失败: {e}")
-            if user_id in self.user_data_cache:
-                del self.user_data_cache[user_id]
+            context.user_data.pop('session', None)
             return ConversationHandler.END
 
     async def cmd_delete_stop_loss(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """处理 /deletestoploss 命令或菜单按钮 - 删除止损订单"""
-        if update.callback_query:
-            await update.callback_query.answer()
         if not self._is_authorized(update):
             await self._unauthorized_handler(update)
             return ConversationHandler.END
-        stop_losses = self.database.get_all_stop_losses()
+        if update.callback_query:
+            await update.callback_query.answer()
+        stop_losses = await self.stop_loss_manager.get_all_stop_loss_orders()
 
         if not stop_losses:
             await self._reply(update, "📭 当前没有止损订单")
             return ConversationHandler.END
 
         # 创建按钮
-        keyboard = []
-        for order in stop_losses:
-            button_text = f"ID:{order.id} {order.symbol} {order.side} @ {order.stop_price}"
-            keyboard.append([InlineKeyboardButton(button_text, callback_data=f"delete_{order.id}")])
-
-        keyboard.append([InlineKeyboardButton("❌ 取消", callback_data="cancel")])
+        keyboard = [
+            [InlineKeyboardButton(
+                f"ID:{order.id} {order.symbol} {order.side} @ {order.stop_price}",
+                callback_data=f"delete|{order.id}"
+            )]
+            for order in stop_losses
+        ]
+        keyboard.append(self.CANCEL_ROW)
         reply_markup = InlineKeyboardMarkup(keyboard)
 
         await self._reply(update, "请选择要删除的止损订单：", reply_markup=reply_markup)
@@ -837,10 +1032,10 @@ class TelegramBot:
             return ConversationHandler.END
         
         # 解析订单ID
-        order_id = int(query.data.split("_")[1])
+        order_id = int(_callback_args(query.data)[0])
         
         # 删除订单
-        success = self.database.delete_stop_loss(order_id)
+        success = await self.stop_loss_manager.delete_stop_loss_order(order_id)
         
         if success:
             await query.edit_message_text(f"✅ 止损订单 {order_id} 已删除")
@@ -851,24 +1046,29 @@ class TelegramBot:
 
     async def cmd_update_stop_loss(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """处理 /updatestoploss 命令或菜单按钮 - 更新止损价格"""
-        if update.callback_query:
-            await update.callback_query.answer()
         if not self._is_authorized(update):
             await self._unauthorized_handler(update)
             return ConversationHandler.END
-        stop_losses = self.database.get_all_stop_losses()
+        if update.callback_query:
+            await update.callback_query.answer()
+        stop_losses = await self.stop_loss_manager.get_all_stop_loss_orders()
 
         if not stop_losses:
             await self._reply(update, "📭 当前没有止损订单")
             return ConversationHandler.END
 
-        # 创建按钮
-        keyboard = []
-        for order in stop_losses:
-            button_text = f"ID:{order.id} {order.symbol} {order.side} @ {order.stop_price} [{order.timeframe}]"
-            keyboard.append([InlineKeyboardButton(button_text, callback_data=f"update_{order.id}")])
+        # 记下列出的订单，用户选中后直接取用，不再按 ID 查询数据库
+        context.user_data['stop_loss_index'] = {order.id: order for order in stop_losses}
 
-        keyboard.append([InlineKeyboardButton("❌ 取消", callback_data="cancel")])
+        # 创建按钮
+        keyboard = [
+            [InlineKeyboardButton(
+                f"ID:{order.id} {order.symbol} {order.side} @ {order.stop_price} [{order.timeframe}]",
+                callback_data=f"update|{order.id}"
+            )]
+            for order in stop_losses
+        ]
+        keyboard.append(self.CANCEL_ROW)
         reply_markup = InlineKeyboardMarkup(keyboard)
 
         await self._reply(update, "请选择要更新的止损订单：", reply_markup=reply_markup)
@@ -880,33 +1080,28 @@ class TelegramBot:
         query = update.callback_query
         await query.answer()
         
+        stop_loss_index = context.user_data.pop('stop_loss_index', None) or {}
+
         if query.data == "cancel":
             await query.edit_message_text("❌ 操作已取消")
             return ConversationHandler.END
         
         # 解析订单ID
-        order_id = int(query.data.split("_")[1])
+        order_id = int(_callback_args(query.data)[0])
         
-        # 获取订单信息
-        order = self.database.get_stop_loss_by_id(order_id)
+        # 获取订单信息（优先使用列表时记下的订单；旧消息上的按钮等情况再查数据库）
+        order = stop_loss_index.get(order_id)
+        if order is None:
+            order = await self.database.get_stop_loss_by_id(order_id)
         
         if not order:
             await query.edit_message_text("❌ 订单不存在")
             return ConversationHandler.END
         
         # 保存到用户数据
-        user_id = query.from_user.id
-        self.user_data_cache[user_id] = {'order_id': order_id, 'order': order, '_created_at': time.time()}
+        context.user_data['session'] = _UpdateStopLossSession(order_id, order)
         
         # 显示修改选项
-        keyboard = [
-            [InlineKeyboardButton("💰 只修改价格", callback_data="field_price")],
-            [InlineKeyboardButton("⏰ 只修改周期", callback_data="field_timeframe")],
-            [InlineKeyboardButton("💰⏰ 修改价格和周期", callback_data="field_both")],
-            [InlineKeyboardButton("❌ 取消", callback_data="cancel")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
         await query.edit_message_text(
             f"当前止损订单信息：\n\n"
             f"交易对: {order.symbol}\n"
@@ -914,7 +1109,7 @@ class TelegramBot:
             f"当前止损价: {order.stop_price}\n"
             f"当前周期: {order.timeframe}\n\n"
             f"请选择要修改的内容：",
-            reply_markup=reply_markup
+            reply_markup=self.UPDATE_FIELD_KEYBOARD
         )
         
         return SELECTING_UPDATE_FIELD
@@ -926,19 +1121,17 @@ class TelegramBot:
         
         if query.data == "cancel":
             await query.edit_message_text("❌ 操作已取消")
-            user_id = query.from_user.id
-            if user_id in self.user_data_cache:
-                del self.user_data_cache[user_id]
+            context.user_data.pop('session', None)
             return ConversationHandler.END
         
-        user_id = query.from_user.id
-        if user_id not in self.user_data_cache:
+        user_data = context.user_data.get('session')
+        if user_data is None:
             await query.edit_message_text("❌ 会话已过期，请重新开始")
             return ConversationHandler.END
         
-        field = query.data.split("_")[1]
-        self.user_data_cache[user_id]['update_field'] = field
-        order = self.user_data_cache[user_id]['order']
+        field = _callback_args(query.data)[0]
+        user_data.update_field = field
+        order = user_data.order
         
         if field == "price":
             # 只修改价格
@@ -950,37 +1143,21 @@ class TelegramBot:
             
         elif field == "timeframe":
             # 只修改周期
-            keyboard = [
-                [InlineKeyboardButton("15 分钟", callback_data="newtf_15m")],
-                [InlineKeyboardButton("1 小时", callback_data="newtf_1h")],
-                [InlineKeyboardButton("4 小时", callback_data="newtf_4h")],
-                [InlineKeyboardButton("❌ 取消", callback_data="cancel")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
             await query.edit_message_text(
                 f"当前周期: {order.timeframe}\n\n"
                 f"请选择新的 K 线周期：",
-                reply_markup=reply_markup
+                reply_markup=self.NEW_TIMEFRAME_KEYBOARD
             )
             return UPDATING_TIMEFRAME
             
         elif field == "both":
             # 修改价格和周期，先选周期
-            self.user_data_cache[user_id]['update_both'] = True
-            
-            keyboard = [
-                [InlineKeyboardButton("15 分钟", callback_data="newtf_15m")],
-                [InlineKeyboardButton("1 小时", callback_data="newtf_1h")],
-                [InlineKeyboardButton("4 小时", callback_data="newtf_4h")],
-                [InlineKeyboardButton("❌ 取消", callback_data="cancel")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            user_data.update_both = True
             
             await query.edit_message_text(
                 f"当前周期: {order.timeframe}\n\n"
                 f"请选择新的 K 线周期：",
-                reply_markup=reply_markup
+                reply_markup=self.NEW_TIMEFRAME_KEYBOARD
             )
             return UPDATING_TIMEFRAME
 
@@ -991,27 +1168,24 @@ class TelegramBot:
         
         if query.data == "cancel":
             await query.edit_message_text("❌ 操作已取消")
-            user_id = query.from_user.id
-            if user_id in self.user_data_cache:
-                del self.user_data_cache[user_id]
+            context.user_data.pop('session', None)
             return ConversationHandler.END
         
-        user_id = query.from_user.id
-        if user_id not in self.user_data_cache:
+        user_data = context.user_data.get('session')
+        if user_data is None:
             await query.edit_message_text("❌ 会话已过期，请重新开始")
             return ConversationHandler.END
         
         # 解析新周期
-        new_timeframe = query.data.split("_")[1]
+        new_timeframe = _callback_args(query.data)[0]
         
-        user_data = self.user_data_cache[user_id]
-        order_id = user_data['order_id']
-        order = user_data['order']
-        update_both = user_data.get('update_both', False)
+        order_id = user_data.order_id
+        order = user_data.order
+        update_both = user_data.update_both
         
         if update_both:
             # 需要继续输入价格
-            self.user_data_cache[user_id]['new_timeframe'] = new_timeframe
+            user_data.new_timeframe = new_timeframe
             
             await query.edit_message_text(
                 f"已选择新周期: {new_timeframe}\n"
@@ -1022,10 +1196,10 @@ class TelegramBot:
         else:
             # 只修改周期，直接更新
             try:
-                success = self.database.update_stop_loss(order_id, timeframe=new_timeframe)
+                success = await self.stop_loss_manager.update_stop_loss_order(order_id, timeframe=new_timeframe)
                 
                 if success:
-                    logger.info(f"止损订单周期更新成功: ID {order_id}, {order.timeframe} -> {new_timeframe}")
+                    logger.info("止损订单周期更新成功: ID %s, %s -> %s", order_id, order.timeframe, new_timeframe)
                     
                     await query.edit_message_text(
                         f"✅ 止损周期已更新！\n\n"
@@ -1041,55 +1215,56 @@ class TelegramBot:
                     await query.edit_message_text(f"❌ 更新失败，订单 {order_id} 可能已不存在")
                 
                 # 清理缓存
-                del self.user_data_cache[user_id]
+                context.user_data.pop('session', None)
                 
                 return ConversationHandler.END
                 
             except Exception as e:
-                logger.error(f"更新止损周期时出错: {e}", exc_info=True)
+                logger.error("更新止损周期时出错: %s", e, exc_info=True)
                 await query.edit_message_text(f"❌ 更新止损周期失败: {e}")
-                if user_id in self.user_data_cache:
-                    del self.user_data_cache[user_id]
+                context.user_data.pop('session', None)
                 return ConversationHandler.END
 
     async def update_price(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """更新止损价格"""
         try:
             user_id = update.message.from_user.id
-            logger.info(f"用户 {user_id} 输入新价格: {update.message.text}")
+            logger.info("用户 %s 输入新价格: %s", user_id, update.message.text)
             
-            if user_id not in self.user_data_cache:
-                logger.warning(f"用户 {user_id} 的会话数据不存在")
+            user_data = context.user_data.get('session')
+            if user_data is None:
+                logger.warning("用户 %s 的会话数据不存在", user_id)
                 await update.message.reply_text("❌ 会话已过期，请重新开始")
                 return ConversationHandler.END
             
             # 解析新价格
-            try:
-                new_stop_price = float(update.message.text)
-            except ValueError:
-                logger.warning(f"用户 {user_id} 输入的价格格式错误: {update.message.text}")
-                await update.message.reply_text("❌ 价格格式错误，请输入有效数字")
+            new_stop_price = _parse_price(update.message.text)
+            if new_stop_price is None:
+                logger.warning("用户 %s 输入的价格格式错误: %s", user_id, update.message.text)
+                await update.message.reply_text("❌ 价格格式错误，请输入大于 0 的数字")
                 return UPDATING_PRICE
             
-            user_data = self.user_data_cache[user_id]
-            order_id = user_data['order_id']
-            order = user_data['order']
-            new_timeframe = user_data.get('new_timeframe')
-            update_both = user_data.get('update_both', False)
+            order_id = user_data.order_id
+            order = user_data.order
+            new_timeframe = user_data.new_timeframe
+            update_both = user_data.update_both
             
             # 根据是否同时更新周期来更新
             if update_both and new_timeframe:
                 # 同时更新价格和周期
-                logger.info(f"准备更新止损订单 {order_id}: 价格 {order.stop_price} -> {new_stop_price}, 周期 {order.timeframe} -> {new_timeframe}")
+                logger.info(
+                    "准备更新止损订单 %s: 价格 %s -> %s, 周期 %s -> %s",
+                    order_id, order.stop_price, new_stop_price, order.timeframe, new_timeframe
+                )
                 
-                success = self.database.update_stop_loss(
+                success = await self.stop_loss_manager.update_stop_loss_order(
                     order_id, 
                     stop_price=new_stop_price,
                     timeframe=new_timeframe
                 )
                 
                 if success:
-                    logger.info(f"止损订单更新成功: ID {order_id}")
+                    logger.info("止损订单更新成功: ID %s", order_id)
                     
                     await update.message.reply_text(
                         f"✅ 止损订单已更新！\n\n"
@@ -1104,12 +1279,12 @@ class TelegramBot:
                     await update.message.reply_text(f"❌ 更新失败，订单 {order_id} 可能已不存在")
             else:
                 # 只更新价格
-                logger.info(f"准备更新止损订单 {order_id}: {order.stop_price} -> {new_stop_price}")
+                logger.info("准备更新止损订单 %s: %s -> %s", order_id, order.stop_price, new_stop_price)
                 
-                success = self.database.update_stop_loss(order_id, stop_price=new_stop_price)
+                success = await self.stop_loss_manager.update_stop_loss_order(order_id, stop_price=new_stop_price)
                 
                 if success:
-                    logger.info(f"止损订单价格更新成功: ID {order_id}")
+                    logger.info("止损订单价格更新成功: ID %s", order_id)
                     
                     await update.message.reply_text(
                         f"✅ 止损价格已更新！\n\n"
@@ -1124,57 +1299,50 @@ class TelegramBot:
                     await update.message.reply_text(f"❌ 更新失败，订单 {order_id} 可能已不存在")
             
             # 清理缓存
-            del self.user_data_cache[user_id]
+            context.user_data.pop('session', None)
             
             return ConversationHandler.END
             
         except Exception as e:
-            logger.error(f"更新止损价格时出错: {e}", exc_info=True)
-            user_id = update.message.from_user.id
+            logger.error("更新止损价格时出错: %s", e, exc_info=True)
             await update.message.reply_text(f"❌ 更新止损价格失败: {e}")
-            if user_id in self.user_data_cache:
-                del self.user_data_cache[user_id]
+            context.user_data.pop('session', None)
             return ConversationHandler.END
 
     async def cmd_cancel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """处理 /cancel 命令 - 取消当前操作"""
-        user_id = update.message.from_user.id
-        if user_id in self.user_data_cache:
-            del self.user_data_cache[user_id]
+        context.user_data.pop('session', None)
         
         await update.message.reply_text("❌ 操作已取消")
         return ConversationHandler.END
 
     async def button_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """处理其他按钮回调"""
+        if not self._is_authorized(update):
+            await self._unauthorized_handler(update)
+            return
         query = update.callback_query
         await query.answer()
 
-        if not query.data or not query.data.startswith("help_"):
+        prefix, _, command = (query.data or "").partition("_")
+        if prefix != "help":
             return
 
-        command = query.data[5:]  # 去掉 help_ 前缀
-        chat_id = query.message.chat_id
-
-        # 查询类命令：直接复用命令处理函数
-        handler_map = {
-            "positions": self.cmd_positions,
-            "orders": self.cmd_orders,
-            "stoplosses": self.cmd_stop_losses,
-            "balance": self.cmd_balance,
-        }
-
-        if command in handler_map:
-            await handler_map[command](update, context)
-            return
+        handler = self._help_query_handlers.get(command)
+        if handler:
+            await handler(update, context)
 
     # ==================== 通知方法 ====================
     
-    async def notify_position_update(self, position: Dict):
-        """通知持仓更新（开仓或持仓变化）"""
+    async def notify_position_updates(self, positions: List[Dict]):
+        """通知持仓更新（开仓或持仓变化），逐个入队，由发件箱合并发送"""
+        for position in positions:
+            await self.send_message(self._format_position_update(position))
+
+    def _format_position_update(self, position: Dict) -> str:
+        """构建单个持仓更新的通知文本"""
         # 根据方向选择emoji
-        side_icon = "🟢" if position['side'] == 'LONG' else "🔴"
-        side_text = "做多" if position['side'] == 'LONG' else "做空"
+        side_icon, side_text = self.POSITION_SIDE_DISPLAY.get(position['side'], self.SHORT_SIDE_DISPLAY)
         
         # 根据盈亏选择emoji和颜色
         pnl = float(position['unrealized_pnl'])
@@ -1199,13 +1367,12 @@ class TelegramBot:
             f"⚠️ 强平价：{position['liquidation_price']}\n"
             + self.NOTIFICATION_BOTTOM_SEPARATOR
         )
-        await self.send_message(text)
+        return text
 
     async def notify_position_closed(self, data: Dict):
         """通知平仓"""
         # 根据方向选择emoji
-        side_icon = "🟢" if data['previous_side'] == 'LONG' else "🔴"
-        side_text = "做多" if data['previous_side'] == 'LONG' else "做空"
+        side_icon, side_text = self.POSITION_SIDE_DISPLAY.get(data['previous_side'], self.SHORT_SIDE_DISPLAY)
 
         text = (
             self._build_notification_header("🔒 持仓平仓通知")
@@ -1223,7 +1390,7 @@ class TelegramBot:
             balance_text = await self._build_balance_text()
             await self.send_message(balance_text)
         except Exception as e:
-            logger.error(f"平仓后获取余额失败: {e}")
+            logger.error("平仓后获取余额失败: %s", e)
 
     async def notify_order_update(self, order: Dict):
         """通知订单更新"""
@@ -1232,74 +1399,54 @@ class TelegramBot:
         # 通知：NEW（新订单）、FILLED（完全成交）、CANCELED（取消）、EXPIRED（过期）、REJECTED（拒绝）
         status = order['status']
         
-        if status in ['PARTIALLY_FILLED']:
+        if status == 'PARTIALLY_FILLED':
             # 不发送通知，避免太多噪音
-            logger.info(f"跳过订单状态通知: {order['symbol']} {status}")
+            logger.info("跳过订单状态通知: %s %s", order['symbol'], status)
             return
         
         # 根据方向选择emoji
         side_icon = "🟢" if order['side'] == 'BUY' else "🔴"
-        side_text_map = {
-            'BUY': '买入/做多',
-            'SELL': '卖出/做空'
-        }
-        side_text = side_text_map.get(order['side'], order['side'])
+        side_text = self.ORDER_SIDE_TEXT.get(order['side'], order['side'])
         
         # 根据订单类型选择emoji和描述
-        type_map = {
-            'MARKET': ('⚡', '市价单'),
-            'LIMIT': ('📌', '限价单'),
-            'STOP': ('🛑', '止损单'),
-            'STOP_MARKET': ('🛑', '止损市价单'),
-            'TAKE_PROFIT': ('🎯', '止盈单'),
-            'TAKE_PROFIT_MARKET': ('🎯', '止盈市价单'),
-        }
-        type_icon, type_text = type_map.get(order['type'], ('📋', order['type']))
+        type_icon, type_text = self.ORDER_TYPE_DISPLAY.get(order['type'], ('📋', order['type']))
         
         # 根据订单状态选择emoji和描述
-        status_map = {
-            'NEW': ('🆕', '已创建'),
-            'FILLED': ('✅', '已完全成交'),
-            'CANCELED': ('❌', '已取消'),
-            'EXPIRED': ('⏰', '已过期'),
-            'REJECTED': ('🚫', '已拒绝'),
-            'PARTIALLY_FILLED': ('⏳', '部分成交'),
-        }
-        status_icon, status_text = status_map.get(status, ('📋', status))
+        status_icon, status_text = self.ORDER_STATUS_DISPLAY.get(status, ('📋', status))
         
         # 构建消息
-        text = (
-            self._build_notification_header("📋 订单更新通知")
-            + f"🏷 交易对：{order['symbol']}\n"
+        parts = [
+            self._build_notification_header("📋 订单更新通知"),
+            f"🏷 交易对：{order['symbol']}\n"
             f"🆔 订单ID：{order['order_id']}\n"
             f"{side_icon} 方向：{side_text}\n"
             f"{type_icon} 类型：{type_text}\n"
             f"{status_icon} 状态：{status_text}\n"
-        )
+        ]
         
         # 添加价格信息
         if order.get('price') and float(order.get('price', 0)) > 0:
-            text += f"💵 价格：{order['price']}\n"
+            parts.append(f"💵 价格：{order['price']}\n")
         
         # 添加触发价格（如果有）
         if order.get('stop_price') and float(order['stop_price']) > 0:
-            text += f"🎯 触发价：{order['stop_price']}\n"
+            parts.append(f"🎯 触发价：{order['stop_price']}\n")
         
         # 添加数量信息
-        text += f"📦 数量：{order['quantity']}\n"
+        parts.append(f"📦 数量：{order['quantity']}\n")
         
         # 添加已成交数量（如果有）
         executed_qty = order.get('executed_qty', 0)
         if executed_qty and float(executed_qty) > 0:
-            text += f"✓ 已成交：{executed_qty}\n"
+            parts.append(f"✓ 已成交：{executed_qty}\n")
         
         # 添加只减仓标识
         if order.get('reduce_only'):
-            text += f"⚠️ 只减仓：是\n"
+            parts.append("⚠️ 只减仓：是\n")
         
-        text += self.NOTIFICATION_BOTTOM_SEPARATOR
+        parts.append(self.NOTIFICATION_BOTTOM_SEPARATOR)
         
-        await self.send_message(text)
+        await self.send_message("".join(parts))
 
     async def notify_stop_loss_triggered(self, data: Dict):
         """通知止损触发"""
@@ -1308,8 +1455,7 @@ class TelegramBot:
         if action == 'executed':
             order = data['order']
             # 根据方向选择emoji
-            side_icon = "🟢" if order['side'] == 'LONG' else "🔴"
-            side_text = "做多" if order['side'] == 'LONG' else "做空"
+            side_icon, side_text = self.POSITION_SIDE_DISPLAY.get(order['side'], self.SHORT_SIDE_DISPLAY)
             
             text = (
                 self._build_notification_header("🛡️ 止损已触发执行！")
@@ -1333,8 +1479,7 @@ class TelegramBot:
         elif action == 'cleaned':
             deleted_count = data.get('deleted_count', 0)
             side = data.get('side', '')
-            side_icon = "🟢" if side == 'LONG' else "🔴"
-            side_text = "做多" if side == 'LONG' else "做空"
+            side_icon, side_text = self.POSITION_SIDE_DISPLAY.get(side, self.SHORT_SIDE_DISPLAY)
             
             text = (
                 self._build_notification_header("🧹 自动清理通知")
@@ -1357,43 +1502,32 @@ class TelegramBot:
         if not evaluations:
             return
         
-        # 按交易对分组评估信息
-        symbol_evaluations = {}
+        # 单次遍历：逐条格式化评估信息，按交易对分组写入各自的行缓冲
+        symbol_lines = defaultdict(list)
         for eval_data in evaluations:
-            symbol = eval_data['symbol']
-            if symbol not in symbol_evaluations:
-                symbol_evaluations[symbol] = []
-            symbol_evaluations[symbol].append(eval_data)
+            close_price = eval_data['close_price']
+            stop_price = eval_data['stop_price']
+            side = eval_data['side']
+            
+            # 计算价格差（多单为收盘价减止损价，空单相反）
+            price_diff = close_price - stop_price if side == 'LONG' else stop_price - close_price
+            price_diff_pct = (price_diff / stop_price) * 100 if stop_price > 0 else 0
+            
+            status_icon, status_text = ("🔴", "应执行止损") if eval_data['should_trigger'] else ("🟢", "无需止损")
+            
+            symbol_lines[eval_data['symbol']].append(
+                f"  {status_icon} {side} | "
+                f"收盘价: {close_price:.4f} | "
+                f"止损价: {stop_price:.4f}\n"
+                f"     差价: {price_diff:+.4f} ({price_diff_pct:+.2f}%) | "
+                f"{status_text}\n"
+            )
         
         # 构建消息文本
-        text = f"📊 K线收盘评估 [{timeframe}]\n\n"
+        parts = [f"📊 K线收盘评估 [{timeframe}]\n\n"]
+        for symbol, lines in symbol_lines.items():
+            parts.append(f"🔸 {symbol}\n")
+            parts.extend(lines)
+            parts.append("\n")
         
-        for symbol, evals in symbol_evaluations.items():
-            text += f"🔸 {symbol}\n"
-            for eval_data in evals:
-                close_price = eval_data['close_price']
-                stop_price = eval_data['stop_price']
-                side = eval_data['side']
-                should_trigger = eval_data['should_trigger']
-                
-                # 计算价格差
-                if side == 'LONG':
-                    price_diff = close_price - stop_price
-                    price_diff_pct = (price_diff / stop_price) * 100 if stop_price > 0 else 0
-                else:  # SHORT
-                    price_diff = stop_price - close_price
-                    price_diff_pct = (price_diff / stop_price) * 100 if stop_price > 0 else 0
-                
-                status_icon = "🔴" if should_trigger else "🟢"
-                status_text = "应执行止损" if should_trigger else "无需止损"
-                
-                text += (
-                    f"  {status_icon} {side} | "
-                    f"收盘价: {close_price:.4f} | "
-                    f"止损价: {stop_price:.4f}\n"
-                    f"     差价: {price_diff:+.4f} ({price_diff_pct:+.2f}%) | "
-                    f"{status_text}\n"
-                )
-            text += "\n"
-        
-        await self.send_message(text)
+        await self.send_message("".join(parts))